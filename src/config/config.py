@@ -39,9 +39,72 @@ ENABLE_FFMPEG = get_env("ENABLE_FFMPEG")
 AUDIO_FORMAT = get_env("AUDIO_FORMAT", "m4a")
 M3U8_SUPPORT = get_env("M3U8_SUPPORT")
 ENABLE_ARIA2 = get_env("ENABLE_ARIA2")
+# multi-connection downloads for plain http formats, set RANGE_CONNECTIONS to 1 to use yt-dlp's own downloader
+RANGE_CONNECTIONS = get_env("RANGE_CONNECTIONS", 8)
+RANGE_MAX_PER_HOST = get_env("RANGE_MAX_PER_HOST", 16)
+RANGE_MIN_SIZE = get_env("RANGE_MIN_SIZE", 10 * 1024 * 1024)
+# fragment concurrency is tuned per job within these bounds, all jobs share FRAGMENT_BUDGET. Empty values use the defaults
+FRAGMENT_BUDGET = int(get_env("FRAGMENT_BUDGET") or (os.cpu_count() or 1) * 16)
+FRAGMENT_MIN = int(get_env("FRAGMENT_MIN") or 1)
+FRAGMENT_MAX = int(get_env("FRAGMENT_MAX") or 16)
+# NIC capacity in Mbit/s, 0 means unknown
+FRAGMENT_NIC_MBPS = int(get_env("FRAGMENT_NIC_MBPS") or 0)
+# warm YoutubeDL instances kept for reuse, each one is recycled after YTDL_POOL_MAX_USES jobs
+YTDL_POOL_SIZE = get_env("YTDL_POOL_SIZE", 8)
+YTDL_POOL_MAX_USES = get_env("YTDL_POOL_MAX_USES", 50)
+# worker processes for extract_info, 0 extracts in the calling thread, empty uses half the CPUs
+_workers = get_env("EXTRACT_WORKERS")
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 1) // 2) if _workers in (None, "") else int(_workers)
+EXTRACT_TIMEOUT = int(get_env("EXTRACT_TIMEOUT") or 60)
+EXTRACT_MAX_TASKS = int(get_env("EXTRACT_MAX_TASKS") or 50)
+# youtube player clients raced against each other (comma separated, empty disables), the next one starts after HEDGE_DELAY seconds
+HEDGE_CLIENTS = get_env("HEDGE_CLIENTS", "")
+HEDGE_DELAY = float(get_env("HEDGE_DELAY", 2))
+# yt-dlp cache (player js, signature functions), shared by all processes. Empty uses yt-dlp's default
+YTDLP_CACHE_DIR = get_env("YTDLP_CACHE_DIR") or None
+# video resolved at startup to fill the cache, empty disables it
+YTDLP_WARM_URL = get_env("YTDLP_WARM_URL", "https://www.youtube.com/watch?v=jNQXAC9IVRw")
+# learned format fallback order per site, older results count half after this many seconds
+FORMAT_HALF_LIFE = get_env("FORMAT_HALF_LIFE", 3 * 86400)
+# web download tasks kept in memory per process, and seconds a finished task stays queryable
+WEB_TASK_CACHE = get_env("WEB_TASK_CACHE", 1024)
+WEB_TASK_TTL = get_env("WEB_TASK_TTL", 3600)
+# web downloads running at once, info lookups at once, and downloads allowed to wait (429 beyond that)
+WEB_DOWNLOAD_WORKERS = get_env("WEB_DOWNLOAD_WORKERS", 4)
+WEB_INFO_WORKERS = get_env("WEB_INFO_WORKERS", 8)
+WEB_QUEUE_SIZE = get_env("WEB_QUEUE_SIZE", 20)
+# urls accepted by one /api/batch request, and how many of them download at once
+WEB_BATCH_SIZE = get_env("WEB_BATCH_SIZE", 50)
+WEB_BATCH_PARALLEL = get_env("WEB_BATCH_PARALLEL", 2)
+# longest ?wait= a status request may block for, keep it below the front server's read timeout
+WEB_LONG_POLL_MAX = get_env("WEB_LONG_POLL_MAX", 30)
+# /api/info answers are fresh for INFO_CACHE_TTL seconds, then served for INFO_CACHE_STALE more while refreshed
+INFO_CACHE_TTL = get_env("INFO_CACHE_TTL", 600)
+INFO_CACHE_STALE = get_env("INFO_CACHE_STALE", 3600)
+# let the front server send finished web downloads: "accel" (nginx X-Accel-Redirect) or "sendfile" (X-Sendfile), empty is off
+FILE_OFFLOAD = str(get_env("FILE_OFFLOAD") or "").lower()
+# nginx internal location aliased to the temp directory
+FILE_OFFLOAD_PREFIX = get_env("FILE_OFFLOAD_PREFIX") or "/_files"
+# progress messages per second sent to web clients for each task
+PROGRESS_RATE = float(get_env("PROGRESS_RATE", 4))
+# downloaded files shared by the bot and the web, reused by later requests of the same video and format
+MEDIA_STORE_DIR = get_env("MEDIA_STORE_DIR") or None
+# bytes kept before least recently used files are evicted, 0 (default) disables the store
+MEDIA_STORE_BYTES = int(get_env("MEDIA_STORE_BYTES") or 0)
+
+# youtube credentials, several cookie files or po tokens (comma separated) are used round-robin
+COOKIE_FILES = get_env("COOKIE_FILES", "youtube-cookies.txt")
+BROWSERS = get_env("BROWSERS")
+POTOKEN = get_env("POTOKEN")
+# seconds a rate-limited credential is skipped
+CREDENTIAL_COOLDOWN = get_env("CREDENTIAL_COOLDOWN", 600)
 
 RCLONE_PATH = get_env("RCLONE")
 
+# pixeldrain settings
+PIXELDRAIN_API = get_env("PIXELDRAIN_API", "https://pixeldrain.com/api")
+PIXELDRAIN_WORKERS = get_env("PIXELDRAIN_WORKERS", 4)
+
 # payment settings
 ENABLE_VIP = get_env("ENABLE_VIP")
 PROVIDER_TOKEN = get_env("PROVIDER_TOKEN")
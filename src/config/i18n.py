@@ -22,6 +22,8 @@ Join https://t.me/ytdlbot0 for updates.
 
 2. For specific links use `/spdl {URL}`. More info at https://github.com/tgbot-collection/ytdlbot#supported-websites
 
+To download only part of a video, use `/clip {URL} 1:30-2:00`.
+
 3. If the bot doesn't work, try again or join https://t.me/ytdlbot0 for updates.
 
 4. Want to deploy it yourself?
@@ -45,6 +47,8 @@ Language: {}
         "task_received": "Task received.",
         "direct_download_received": "Direct download request received.",
         "spdl_received": "SPDL request received.",
+        "clip_received": "Clip request received, only {}-{} will be downloaded.",
+        "clip_usage": "Usage: `/clip {URL} 1:30-2:00`",
         "group_download_received": "Group download request received.",
         "starting_ping": "Starting Ping...",
         "ping_complete": "Ping Calculation Complete.",
@@ -106,6 +110,8 @@ Language: {}
 
 2. 对于特定链接，使用 `/spdl {URL}`。更多信息请访问 https://github.com/tgbot-collection/ytdlbot#supported-websites
 
+只下载视频的一部分，使用 `/clip {URL} 1:30-2:00`。
+
 3. 如果机器人不工作，请重试或加入 https://t.me/ytdlbot0 获取更新。
 
 4. 想要自己部署？
@@ -129,6 +135,8 @@ Language: {}
         "task_received": "任务已接收。",
         "direct_download_received": "直接下载请求已接收。",
         "spdl_received": "SPDL 请求已接收。",
+        "clip_received": "片段请求已接收，只下载 {}-{}。",
+        "clip_usage": "用法: `/clip {URL} 1:30-2:00`",
         "group_download_received": "批量下载请求已接收。",
         "starting_ping": "正在测试延迟...",
         "ping_complete": "延迟测试完成。",
@@ -4,12 +4,14 @@
 # ytdlbot - cache.py
 
 
+import json
 import logging
+import time
 
 import fakeredis
 import redis
 
-from config import REDIS_HOST
+from config import FORMAT_HALF_LIFE, REDIS_HOST
 
 
 class Redis:
@@ -44,3 +46,130 @@ class Redis:
         """删除待处理的下载记录"""
         key = f"pending:{chat_id}:{msg_id}"
         self.r.delete(key)
+
+    def record_format(self, extractor: str, selector: str, ok: bool, elapsed: float = 0):
+        """记录某个站点上格式选择器的成败和耗时，旧数据按半衰期衰减"""
+        key = f"formats:{extractor}"
+
+        def update(pipe):
+            now = time.time()
+            stat = self._decay(json.loads(pipe.hget(key, selector) or "{}"), now)
+            if ok:
+                # 耗时用指数移动平均
+                stat["time"] = elapsed if not stat["ok"] else stat["time"] * 0.7 + elapsed * 0.3
+                stat["ok"] += 1
+            else:
+                stat["fail"] += 1
+            pipe.multi()
+            pipe.hset(key, selector, json.dumps(stat))
+            pipe.expire(key, FORMAT_HALF_LIFE * 10)
+            pipe.sadd("formats:extractors", extractor)
+
+        # WATCH 该键，并发任务的更新冲突时重读重试，不会互相覆盖
+        self.r.transaction(update, key)
+
+    def get_format_stats(self, extractor: str | None = None) -> dict[str, dict[str, dict]]:
+        """返回 {站点: {选择器: {ok, fail, time}}}，已按当前时间衰减"""
+        now = time.time()
+        extractors = [extractor] if extractor else sorted(self.r.smembers("formats:extractors"))
+        result = {}
+        for name in extractors:
+            if stats := self.r.hgetall(f"formats:{name}"):
+                result[name] = {k: self._decay(json.loads(v), now) for k, v in stats.items()}
+            elif not extractor:
+                self.r.srem("formats:extractors", name)
+        return result
+
+    def record_client_win(self, client: str):
+        """记录每小时最先解析成功的 YouTube player client"""
+        key = f"clients:{time.strftime('%Y%m%d%H')}"
+        self.r.hincrby(key, client, 1)
+        self.r.expire(key, 2 * 86400)
+
+    def get_client_wins(self, hours: int = 3) -> dict[str, int]:
+        """最近几个小时每个 player client 的胜出次数"""
+        now = time.time()
+        wins = {}
+        for i in range(hours):
+            key = f"clients:{time.strftime('%Y%m%d%H', time.localtime(now - i * 3600))}"
+            for client, count in self.r.hgetall(key).items():
+                wins[client] = wins.get(client, 0) + int(count)
+        return wins
+
+    def count_ytdlp_cache(self, section: str, name: str):
+        """yt-dlp 缓存的命中/未命中/写入次数，所有进程（包括解析子进程）累加到一起"""
+        self.r.hincrby("ytcache:stats", f"{section}:{name}", 1)
+
+    def get_ytdlp_cache_stats(self) -> dict[str, dict[str, int]]:
+        stats = {}
+        for field, value in self.r.hgetall("ytcache:stats").items():
+            section, _, name = field.rpartition(":")
+            stats.setdefault(section, {"hit": 0, "miss": 0, "store": 0})[name] = int(value)
+        return stats
+
+    def save_web_task(self, task_id: str, mapping: dict, ttl: int):
+        """写入网页下载任务的字段，过期时间从最后一次更新算起"""
+        key = f"webtask:{task_id}"
+        pipe = self.r.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def get_web_task(self, task_id: str) -> dict:
+        """读取网页下载任务，不存在或已过期时返回空字典"""
+        return self.r.hgetall(f"webtask:{task_id}")
+
+    def get_web_tasks(self, task_ids: list[str]) -> list[dict]:
+        """一次读取多个网页下载任务"""
+        pipe = self.r.pipeline()
+        for task_id in task_ids:
+            pipe.hgetall(f"webtask:{task_id}")
+        return pipe.execute()
+
+    def delete_web_task(self, task_id: str):
+        self.r.delete(f"webtask:{task_id}")
+
+    def save_web_batch(self, batch_id: str, task_ids: list[str], ttl: int):
+        """批量下载包含的任务 id，按提交顺序"""
+        key = f"webbatch:{batch_id}"
+        pipe = self.r.pipeline()
+        pipe.delete(key)
+        pipe.rpush(key, *task_ids)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def get_web_batch(self, batch_id: str) -> list[str]:
+        return self.r.lrange(f"webbatch:{batch_id}", 0, -1)
+
+    def publish_progress(self, task_id: str, message: str, ttl: int):
+        """广播下载进度，同时保存最后一条给之后订阅的客户端"""
+        pipe = self.r.pipeline()
+        pipe.setex(f"progress:{task_id}", ttl, message)
+        pipe.publish("progress", message)
+        pipe.execute()
+
+    def get_progress(self, task_id: str) -> str | None:
+        return self.r.get(f"progress:{task_id}")
+
+    def subscribe_progress(self):
+        pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe("progress")
+        return pubsub
+
+    def get_info(self, key: str) -> dict | None:
+        """网页 /api/info 的缓存结果"""
+        data = self.r.get(f"info:{key}")
+        return json.loads(data) if data else None
+
+    def set_info(self, key: str, value: dict, ttl: int):
+        self.r.setex(f"info:{key}", ttl, json.dumps(value, ensure_ascii=False))
+
+    @staticmethod
+    def _decay(stat: dict, now: float) -> dict:
+        factor = 0.5 ** ((now - stat.get("ts", now)) / FORMAT_HALF_LIFE)
+        return {
+            "ok": stat.get("ok", 0) * factor,
+            "fail": stat.get("fail", 0) * factor,
+            "time": stat.get("time", 0),
+            "ts": now,
+        }
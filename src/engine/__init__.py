@@ -11,6 +11,7 @@ from engine.direct import DirectDownload
 from engine.pixeldrain import pixeldrain_download
 from engine.instagram import InstagramDownload
 from engine.krakenfiles import krakenfiles_download
+from engine.router import URLRouter
 
 
 def youtube_entrance(client, bot_message, url):
@@ -18,6 +19,10 @@ def youtube_entrance(client, bot_message, url):
     youtube.start()
 
 
+def clip_entrance(client, bot_message, url, clip: tuple[float, float]):
+    YoutubeDownload(client, bot_message, url, clip=clip).start()
+
+
 def direct_entrance(client, bot_message, url):
     dl = DirectDownload(client, bot_message, url)
     dl.start()
@@ -35,6 +40,8 @@ DOWNLOADER_MAP: dict[str, Callable[[Any, Any, str], Any]] = {
     "instagram.com": instagram_handler,
 }
 
+router = URLRouter(DOWNLOADER_MAP)
+
 def special_download_entrance(client: Any, bot_message: Any, url: str) -> Any:
     try:
         hostname = urlparse(url).hostname
@@ -47,9 +54,7 @@ def special_download_entrance(client: Any, bot_message: Any, url: str) -> Any:
     if hostname.endswith("youtube.com") or hostname == "youtu.be":
         raise ValueError("ERROR: For YouTube links, just send the link directly.")
 
-    # Iterate through the map to find a matching handler.
-    for domain_suffix, handler_function in DOWNLOADER_MAP.items():
-        if hostname.endswith(domain_suffix):
-            return handler_function(client, bot_message, url)
+    if handler_function := router.special(hostname):
+        return handler_function(client, bot_message, url)
 
     raise ValueError(f"Invalid URL: No specific downloader found for {hostname}")
@@ -31,6 +31,7 @@ from database.model import (
     use_quota,
 )
 from engine.helper import debounce, sizeof_fmt
+from engine.postprocess import is_thumb, thumb_path
 
 
 def generate_input_media(file_paths: list, cap: str) -> list:
@@ -82,7 +83,7 @@ class BaseDownloader(ABC):
         return re.sub(r"\u001b|\[0;94m|\u001b\[0m|\[0;32m|\[0m|\[0;33m", "", text)
 
     @staticmethod
-    def __tqdm_progress(desc, total, finished, speed="", eta=""):
+    def __tqdm_progress(desc, total, finished, speed="", eta="", fragments=""):
         def more(title, initial):
             if initial:
                 return f"{title} {initial}"
@@ -110,6 +111,7 @@ class BaseDownloader(ABC):
     {detail}
     {more("Speed:", speed)}
     {more("ETA:", eta)}
+    {more("Fragments:", fragments)}
         """
         f.close()
         return text
@@ -126,7 +128,7 @@ class BaseDownloader(ABC):
             # percent = remove_bash_color(d.get("_percent_str", "N/A"))
             speed = self.__remove_bash_color(d.get("_speed_str", "N/A"))
             eta = self.__remove_bash_color(d.get("_eta_str", d.get("eta")))
-            text = self.__tqdm_progress("Downloading...", total, downloaded, speed, eta)
+            text = self.__tqdm_progress("Downloading...", total, downloaded, speed, eta, d.get("_fragments_str", ""))
             self.edit_text(text)
 
     def upload_hook(self, current, total):
@@ -196,18 +198,34 @@ class BaseDownloader(ABC):
 
             return self._methods[_type](**send_args)
 
+    def _files(self) -> list:
+        return [i for i in Path(self._tempdir.name).glob("*") if not is_thumb(i)]
+
     def get_metadata(self):
-        video_path = list(Path(self._tempdir.name).glob("*"))[0]
+        video_path = self._files()[0]
         filename = Path(video_path).name
         width = height = duration = 0
         try:
             video_streams = ffmpeg.probe(video_path, select_streams="v")
             for item in video_streams.get("streams", []):
+                if item.get("disposition", {}).get("attached_pic"):
+                    continue  # embedded cover
                 height = item["height"]
                 width = item["width"]
             duration = int(float(video_streams["format"]["duration"]))
         except Exception as e:
             logging.error("Error while getting metadata: %s", e)
+        if thumb_path(video_path).exists():
+            # made from the cover while merging
+            thumb = thumb_path(video_path).as_posix()
+        else:
+            thumb = self._generate_thumb(video_path, duration)
+
+        caption = f"{self._url}\n{filename}\n\nResolution: {width}x{height}\nDuration: {duration} seconds"
+        return dict(height=height, width=width, duration=duration, thumb=thumb, caption=caption)
+
+    @staticmethod
+    def _generate_thumb(video_path, duration) -> str | None:
         try:
             thumb = Path(video_path).parent.joinpath(f"{uuid.uuid4().hex}-thunmnail.png").as_posix()
             # A thumbnail's width and height should not exceed 320 pixels.
@@ -218,13 +236,11 @@ class BaseDownloader(ABC):
             ).output(thumb, vframes=1).run()
         except ffmpeg._run.Error:
             thumb = None
-
-        caption = f"{self._url}\n{filename}\n\nResolution: {width}x{height}\nDuration: {duration} seconds"
-        return dict(height=height, width=width, duration=duration, thumb=thumb, caption=caption)
+        return thumb
 
     def _upload(self, files=None, meta=None):
         if files is None:
-            files = list(Path(self._tempdir.name).glob("*"))
+            files = self._files()
         if meta is None:
             meta = self.get_metadata()
 
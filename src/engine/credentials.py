@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - credentials.py
+
+import logging
+import os
+import re
+import threading
+import time
+
+from yt_dlp import cookies
+from yt_dlp.cookies import YoutubeDLCookieJar, extract_cookies_from_browser
+
+from config import BROWSERS, COOKIE_FILES, CREDENTIAL_COOLDOWN, POTOKEN
+from utils import is_youtube
+
+# a cookie file is ignored when it's smaller than this, e.g. an empty placeholder mounted by docker
+MIN_COOKIE_SIZE = 100
+# seconds between two mtime checks of the same source
+CHECK_INTERVAL = 5
+RATE_LIMITED = re.compile(r"HTTP Error 429|rate.?limit|Sign in to confirm|confirm you.re not a bot", re.I)
+
+
+def _browser_cookie_db(browser: str, profile: str | None = None) -> str | None:
+    # only used to notice changes, yt-dlp finds the database again when extracting
+    try:
+        if browser == "firefox":
+            roots = [profile] if profile and cookies._is_path(profile) else list(cookies._firefox_browser_dirs())
+            return cookies._newest(cookies._firefox_cookie_dbs(roots))
+        if browser in cookies.CHROMIUM_BASED_BROWSERS:
+            root = cookies._get_chromium_based_browser_settings(browser)["browser_dir"]
+            if profile:
+                root = profile if cookies._is_path(profile) else os.path.join(root, profile)
+            return cookies._newest(cookies._find_files(root, "Cookies", cookies.YDLLogger()))
+    except Exception as e:
+        logging.warning("Can't locate cookie database of %s: %s", browser, e)
+    return None
+
+
+class Credential:
+    """One cookie source paired with an optional PO token, the jar is shared by every extraction using it."""
+
+    def __init__(self, source: tuple[str, str | tuple] | None, po_token: str | None):
+        self.source = source
+        self.po_token = po_token
+        self.jar: YoutubeDLCookieJar | None = None
+        self.version = 0
+        self.cooldown_until = 0.0
+        self._mtime = None
+        self._checked = 0.0
+        self._used = False
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        if not self.source:
+            return "potoken"
+        kind, value = self.source
+        return value if kind == "file" else f"browser:{value[0]}"
+
+    @property
+    def usable(self) -> bool:
+        # a source that gave no cookies, e.g. an empty placeholder file or a browser that failed to load
+        return not self.source or bool(self.jar)
+
+    def _path(self) -> str | None:
+        kind, value = self.source
+        return value if kind == "file" else _browser_cookie_db(*value[:2])
+
+    def _load(self) -> YoutubeDLCookieJar | None:
+        kind, value = self.source
+        if kind == "file":
+            if not os.path.isfile(value) or os.path.getsize(value) <= MIN_COOKIE_SIZE:
+                return None
+            jar = YoutubeDLCookieJar(value)
+            jar.load()
+            return jar
+        browser, profile, keyring, container = (*value, None, None, None)[:4]
+        return extract_cookies_from_browser(browser, profile or None, keyring=keyring or None, container=container or None)
+
+    def refresh(self):
+        """Reload the jar when the cookie file or the browser database changed, otherwise save it back"""
+        if not self.source or self.version and time.time() - self._checked < CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked = time.time()
+            path = self._path()
+            mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+            if self.version and mtime == self._mtime:
+                self._save(path)
+                return
+            start = time.time()
+            try:
+                self.jar = self._load()
+            except Exception as e:
+                logging.error("Failed to load cookies from %s: %s", self.name, e)
+                self.jar = None
+            self._mtime = mtime
+            self.version += 1
+            logging.info(
+                "Loaded %s cookies from %s in %.2fs", len(self.jar) if self.jar else 0, self.name, time.time() - start
+            )
+
+    def _save(self, path: str):
+        # cookies the site rotated during the last jobs go back to the file, like yt-dlp does with cookiefile.
+        # An edited file wins instead, it's reloaded.
+        if self.source[0] != "file" or not self.jar or not self._used:
+            return
+        try:
+            self.jar.save(path)
+            self._mtime = os.path.getmtime(path)
+            self._used = False
+        except Exception as e:
+            # the jar may be changing under a running extraction, the next check tries again
+            logging.warning("Failed to save cookies to %s: %s", self.name, e)
+
+    def options(self) -> dict:
+        """yt-dlp options besides the cookie jar, which is handed over separately"""
+        opts = {"credential": f"{self.name}#{self.version}"}
+        if self.po_token:
+            # `client.context+token`, a bare token is used for the web client's video streams
+            token = self.po_token if "+" in self.po_token else f"web.gvs+{self.po_token}"
+            opts["extractor_args"] = {"youtube": {"player_client": ["web", "default"], "po_token": [token]}}
+        return opts
+
+
+class CredentialProvider:
+    """
+    Hand out YouTube cookies and PO tokens round-robin. Each cookie source is loaded once and
+    reloaded when its file changes, a credential that got rate-limited cools down for a while.
+    Sources without cookies are skipped while another one has some.
+    """
+
+    def __init__(self, cookie_files: list[str], browser: tuple | None, po_tokens: list[str], cooldown: int):
+        sources = [("file", path) for path in cookie_files] + ([("browser", browser)] if browser else [])
+        count = max(len(sources), len(po_tokens))
+        self.credentials = [
+            Credential(
+                sources[i % len(sources)] if sources else None,
+                po_tokens[i % len(po_tokens)] if po_tokens else None,
+            )
+            for i in range(count)
+        ]
+        self.cooldown = cooldown
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str) -> Credential | None:
+        if not self.credentials or not is_youtube(url):
+            return None
+        now = time.time()
+        with self._lock:
+            ordered = self.credentials[self._next :] + self.credentials[: self._next]
+        # when every credential is cooling down, take the one that recovers first
+        ready = [c for c in ordered if c.cooldown_until <= now] or [min(ordered, key=lambda c: c.cooldown_until)]
+        for c in ready:
+            # cheap, the sources are checked at most every CHECK_INTERVAL seconds
+            c.refresh()
+        cred = next((c for c in ready if c.usable), ready[0])
+        with self._lock:
+            self._next = (self.credentials.index(cred) + 1) % len(self.credentials)
+        cred._used = True
+        return cred
+
+    def report(self, cred: Credential | None, error: Exception):
+        if cred and RATE_LIMITED.search(str(error)):
+            cred.cooldown_until = time.time() + self.cooldown
+            logging.warning("Credential %s is rate-limited, cooling down for %ss", cred.name, self.cooldown)
+
+    def snapshot(self) -> list[dict]:
+        now = time.time()
+        return [
+            {
+                "name": c.name,
+                "cookies": len(c.jar) if c.jar else 0,
+                "po_token": bool(c.po_token),
+                "version": c.version,
+                "cooldown": max(0, int(c.cooldown_until - now)),
+            }
+            for c in self.credentials
+        ]
+
+
+def _split(value) -> list[str]:
+    return [i.strip() for i in str(value or "").split(",") if i.strip()]
+
+
+credentials = CredentialProvider(
+    _split(COOKIE_FILES),
+    tuple(str(BROWSERS).split(",")) if BROWSERS else None,
+    _split(POTOKEN),
+    CREDENTIAL_COOLDOWN,
+)
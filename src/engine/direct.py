@@ -10,16 +10,75 @@ import pathlib
 import subprocess
 import tempfile
 from pathlib import Path
+from urllib.parse import unquote
 from uuid import uuid4
 
 import filetype
 import requests
 
-from config import ENABLE_ARIA2, TMPFILE_PATH
+from config import ENABLE_ARIA2, TG_NORMAL_MAX_SIZE, TMPFILE_PATH
 from engine.base import BaseDownloader
+from utils import extract_filename, sizeof_fmt
+
+# playlists and manifests are left to yt-dlp
+MANIFEST_TYPES = {"application/vnd.apple.mpegurl", "application/x-mpegurl", "audio/mpegurl", "audio/x-mpegurl", "application/dash+xml"}
+BINARY_TYPES = {
+    "application/octet-stream",
+    "application/zip",
+    "application/x-zip-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/x-7z-compressed",
+    "application/gzip",
+    "application/x-tar",
+    "application/pdf",
+    "application/vnd.android.package-archive",
+}
+
+
+def probe_direct_link(url: str) -> dict | None:
+    """
+    Cheaply check whether the url is a plain file, so it can skip yt-dlp's generic extractor.
+    Return file name, size and content type for media or binary responses, None otherwise.
+    """
+    try:
+        resp = requests.head(url, allow_redirects=True, timeout=10)
+        if resp.status_code >= 400 or "content-type" not in resp.headers:
+            # some servers don't implement HEAD, ask for the first byte instead
+            resp = requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=10)
+            resp.close()
+    except requests.RequestException as e:
+        logging.info("Probe failed for %s: %s", url, e)
+        return None
+    if resp.status_code >= 400:
+        return None
+
+    content_type = resp.headers.get("content-type", "").split(";")[0].strip().lower()
+    attachment = "attachment" in resp.headers.get("content-disposition", "").lower()
+    is_media = content_type.split("/")[0] in ("video", "audio", "image") and content_type not in MANIFEST_TYPES
+    if not (is_media or content_type in BINARY_TYPES or attachment):
+        return None
+
+    size = 0
+    if content_range := resp.headers.get("content-range"):
+        # bytes 0-0/12345
+        total = content_range.rsplit("/", 1)[-1]
+        size = int(total) if total.isdigit() else 0
+    elif resp.status_code != 206:
+        size = int(resp.headers.get("content-length") or 0)
+    if size > TG_NORMAL_MAX_SIZE:
+        raise ValueError(f"Your download file size {sizeof_fmt(size)} is too large for Telegram.")
+
+    filename = unquote(extract_filename(resp)).split("?")[0].strip("\"'; ")
+    logging.info("Probe for %s: %s, %s bytes, %s", url, content_type, size, filename)
+    return {"filename": filename, "size": size, "content_type": content_type}
 
 
 class DirectDownload(BaseDownloader):
+    def __init__(self, client, bot_msg, url: str, filename: str | None = None):
+        super().__init__(client, bot_msg, url)
+        # optional file name when the caller already knows it, e.g. from an API or a HEAD probe
+        self._filename = Path(filename).name if filename else None
 
     def _setup_formats(self) -> list | None:
         # direct download doesn't need to setup formats
@@ -42,12 +101,12 @@ class DirectDownload(BaseDownloader):
         logging.info("Requests download with url %s", self._url)
         response = requests.get(self._url, stream=True)
         response.raise_for_status()
-        file = Path(self._tempdir.name).joinpath(uuid4().hex)
+        file = Path(self._tempdir.name).joinpath(self._filename or uuid4().hex)
         with open(file, "wb") as f:
             for chunk in response.iter_content(chunk_size=8192):
                 f.write(chunk)
         ext = filetype.guess_extension(file)
-        if ext is not None:
+        if ext is not None and not file.suffix:
             new_name = file.with_suffix(f".{ext}")
             file.rename(new_name)
 
@@ -73,6 +132,7 @@ class DirectDownload(BaseDownloader):
                 "--human-readable=true",
                 f"--user-agent={ua}",
                 "-d", temp_dir,
+                *(["-o", self._filename] if self._filename else []),
                 self._url,
             ]
 
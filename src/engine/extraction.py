@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - extraction.py
+
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from config import EXTRACT_MAX_TASKS, EXTRACT_TIMEOUT, EXTRACT_WORKERS, HEDGE_CLIENTS, HEDGE_DELAY
+from database import Redis
+from engine.credentials import Credential, credentials
+from engine.pool import pool
+from utils import is_youtube
+
+# what the format planner and the web api read from an info dict
+INFO_FIELDS = ("id", "title", "duration", "extractor", "extractor_key", "webpage_url", "thumbnail", "uploader")
+FORMAT_FIELDS = (
+    "format_id", "ext", "height", "width", "fps", "vcodec", "acodec",
+    "tbr", "filesize", "filesize_approx", "protocol", "format_note",
+)
+
+
+class ExtractionError(Exception):
+    """yt-dlp error raised in a worker, only the message crosses the process boundary"""
+
+
+def slim_info(info: dict) -> dict:
+    # missing fields stay missing, callers rely on .get(key, default)
+    slim = {k: info[k] for k in INFO_FIELDS if k in info}
+    slim["formats"] = [{k: f[k] for k in FORMAT_FIELDS if k in f} for f in info.get("formats") or []]
+    return slim
+
+
+def usable(info: dict) -> bool:
+    # a throttled or SABR-only client leaves nothing but storyboards
+    return any(
+        f.get("protocol") != "mhtml" and (f.get("vcodec") or "none") + (f.get("acodec") or "none") != "nonenone"
+        for f in info.get("formats") or []
+    )
+
+
+def with_clients(profile: dict, clients: list[str]) -> dict:
+    """Copy of profile with YouTube's player_client replaced, po token and other extractor args are kept"""
+    args = profile.get("extractor_args") or {}
+    youtube = {**args.get("youtube", {}), "player_client": list(clients)}
+    return {**profile, "extractor_args": {**args, "youtube": youtube}}
+
+
+def _alarm(signum, frame):
+    raise TimeoutError(f"extraction took longer than {EXTRACT_TIMEOUT}s")
+
+
+def _init_worker():
+    # load the extractor classes once per worker instead of on its first job
+    from yt_dlp.extractor import gen_extractor_classes
+
+    gen_extractor_classes()
+    signal.signal(signal.SIGALRM, _alarm)
+
+
+def _extract(url: str, profile: dict, cred_index: int | None) -> dict:
+    # runs in a worker process, which keeps its own warm YoutubeDL instances and cookie jars
+    cred = credentials.credentials[cred_index] if cred_index is not None else None
+    if cred:
+        # the jar may have been reloaded in this process, extractor args come from the caller
+        cred.refresh()
+        profile = {**profile, "credential": cred.options()["credential"]}
+    signal.alarm(EXTRACT_TIMEOUT)
+    try:
+        with pool.checkout(profile, cred.jar if cred else None) as ydl:
+            return slim_info(ydl.extract_info(url, download=False))
+    except Exception as e:
+        raise ExtractionError(str(e)) from None
+    finally:
+        signal.alarm(0)
+
+
+class ExtractionService:
+    """
+    Run extract_info in a pool of worker processes so JSON parsing and JS challenges don't hold the GIL of the bot.
+    Workers are replaced after `max_tasks` extractions, a hung pool is killed and recreated.
+    With hedge clients set, YouTube extractions race several player clients, see `race`.
+    """
+
+    def __init__(self, workers: int, timeout: int, max_tasks: int, clients: list[str], delay: float):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self.clients = clients
+        self.delay = delay
+        self._executor: ProcessPoolExecutor | None = None
+        self._threads: ThreadPoolExecutor | None = None
+        self._redis: Redis | None = None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "timeouts": 0, "restarts": 0, "races": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    max_tasks_per_child=self.max_tasks,
+                )
+            return self._executor
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.stats["restarts"] += 1
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, url: str, profile: dict, cred: Credential | None = None) -> dict:
+        """Slimmed info dict of url, see INFO_FIELDS and FORMAT_FIELDS"""
+        with self._lock:
+            self.stats["calls"] += 1
+        if self.clients and is_youtube(url):
+            return self.race(url, profile, cred)
+        if not self.workers:
+            return self._extract_local(url, profile, cred)
+
+        cred_index = credentials.credentials.index(cred) if cred else None
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_extract, url, profile, cred_index)
+            started = None
+            while True:
+                try:
+                    return future.result(timeout=1)
+                except FutureTimeout:
+                    # time spent queued doesn't count. The worker gives up by itself after timeout,
+                    # this only catches a stuck process
+                    started = started or (time.time() if future.running() else None)
+                    if started and time.time() - started > self.timeout + 10:
+                        break
+            with self._lock:
+                self.stats["timeouts"] += 1
+            logging.error("Extraction of %s is stuck, restarting workers", url)
+            self._restart(executor)
+            raise TimeoutError(f"extraction of {url} timed out")
+        except BrokenProcessPool:
+            logging.error("Extraction workers died, restarting them")
+            self._restart(executor)
+            raise
+
+    def _submit(self, url: str, profile: dict, cred: Credential | None) -> Future:
+        if not self.workers:
+            with self._lock:
+                self._threads = self._threads or ThreadPoolExecutor(len(self.clients), thread_name_prefix="hedge")
+            return self._threads.submit(self._extract_local, url, profile, cred)
+        cred_index = credentials.credentials.index(cred) if cred else None
+        return self._get_executor().submit(_extract, url, profile, cred_index)
+
+    @staticmethod
+    def _extract_local(url: str, profile: dict, cred: Credential | None) -> dict:
+        with pool.checkout(profile, cred.jar if cred else None) as ydl:
+            return slim_info(ydl.extract_info(url, download=False))
+
+    @property
+    def redis(self) -> Redis:
+        self._redis = self._redis or Redis()
+        return self._redis
+
+    def client_order(self) -> list[str]:
+        """Hedge clients, the ones that won most often in the last hours first"""
+        if not self.clients:
+            return []
+        wins = self.redis.get_client_wins()
+        return sorted(self.clients, key=lambda c: -wins.get(c, 0))
+
+    def race(self, url: str, profile: dict, cred: Credential | None = None) -> dict:
+        """
+        Extract with one player client after another, each started `delay` seconds after the previous one
+        or as soon as it fails. The first result with usable formats wins, the others are cancelled,
+        or discarded when they already run in a worker.
+        """
+        with self._lock:
+            self.stats["races"] += 1
+        queue = self.client_order()
+        pending: dict[Future, str] = {}
+        last_error = None
+        start = time.time()
+        while queue or pending:
+            if queue:
+                client = queue.pop(0)
+                pending[self._submit(url, with_clients(profile, [client]), cred)] = client
+            done, _ = wait(pending, timeout=self.delay if queue else self.timeout + 10, return_when=FIRST_COMPLETED)
+            if not done and not queue:
+                for future in pending:
+                    future.cancel()
+                with self._lock:
+                    self.stats["timeouts"] += 1
+                raise TimeoutError(f"extraction of {url} timed out")
+            for future in done:
+                client = pending.pop(future)
+                try:
+                    info = future.result()
+                except Exception as e:
+                    logging.warning("Player client %s failed for %s: %s", client, url, e)
+                    last_error = e
+                    continue
+                if not usable(info):
+                    logging.warning("Player client %s returned no usable formats for %s", client, url)
+                    last_error = ExtractionError(f"player client {client} returned no usable formats")
+                    continue
+                for other in pending:
+                    other.cancel()
+                logging.info("Player client %s won for %s in %.2fs", client, url, time.time() - start)
+                self.redis.record_client_win(client)
+                return info
+        raise last_error
+
+    def snapshot(self) -> dict:
+        return {"workers": self.workers, **self.stats, "clients": self.client_order()}
+
+
+extraction = ExtractionService(
+    EXTRACT_WORKERS,
+    EXTRACT_TIMEOUT,
+    EXTRACT_MAX_TASKS,
+    [i.strip() for i in str(HEDGE_CLIENTS or "").split(",") if i.strip()],
+    HEDGE_DELAY,
+)
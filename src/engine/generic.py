@@ -4,15 +4,24 @@
 # ytdlbot - generic.py
 
 import logging
-import os
+import time
 from pathlib import Path
 
 import yt_dlp
+from yt_dlp.utils import download_range_func
 
-from config import AUDIO_FORMAT
+from config import AUDIO_FORMAT, RANGE_CONNECTIONS, TG_NORMAL_MAX_SIZE
 from utils import is_youtube
 from database.model import get_format_settings, get_quality_settings
 from engine.base import BaseDownloader
+from engine.credentials import credentials
+from engine.extraction import extraction, with_clients
+from engine.planner import estimate_selection, plan_choices, plan_formats
+from engine.pool import pool
+from engine.postprocess import is_thumb
+from engine.ranged import RANGED_DOWNLOADER
+from engine.store import media_store, store_key
+from engine.tuner import tuner
 
 
 def match_filter(info_dict):
@@ -21,61 +30,81 @@ def match_filter(info_dict):
     return None  # Allow download for non-live videos
 
 
+def select_formats(ydl: yt_dlp.YoutubeDL, info: dict, spec: str | None) -> list[dict]:
+    """Evaluate a format selector locally against an already extracted info dict"""
+    selector = ydl.build_format_selector(spec or ydl._default_format_spec(info))
+    return ydl._select_formats(info.get("formats") or [info], selector)
+
+
+def order_formats(stats: dict[str, dict], formats: list) -> list:
+    """Reorder fallback selectors by their observed success rate, then latency. Unknown ones keep their place."""
+
+    def rank(item):
+        index, f = item
+        stat = stats.get(f or "default")
+        if not stat:
+            return -0.5, 0, index
+        rate = (stat["ok"] + 1) / (stat["ok"] + stat["fail"] + 2)
+        # similar success rates are compared by latency
+        return -round(rate, 1), stat["time"], index
+
+    return [f for _, f in sorted(enumerate(dict.fromkeys(formats)), key=rank)]
+
+
 class YoutubeDownload(BaseDownloader):
-    def get_available_formats(self) -> list[dict]:
-        """使用 yt-dlp extract_info 获取视频可用格式列表"""
-        ydl_opts = {
+    # prepend explicit format ids from the planner, off when the user picked a format
+    _plan = False
+
+    def __init__(self, client, bot_msg, url: str, clip: tuple[float, float] | None = None):
+        super().__init__(client, bot_msg, url)
+        # (start, end) in seconds, only the fragments covering it are downloaded
+        self._clip = clip
+
+    def _calc_video_key(self):
+        key = super()._calc_video_key()
+        return f"{key}:clip:{self._clip[0]:g}-{self._clip[1]:g}" if self._clip else key
+
+    def _profile(self) -> dict:
+        # options shared by every job with the same credentials, pooled YoutubeDL instances are keyed by them
+        profile = {
             "quiet": True,
             "no_warnings": True,
+            "restrictfilenames": False,
+            "buffersize": 4194304,
+            "retries": 6,
+            "fragment_retries": 6,
+            "skip_unavailable_fragments": True,
+            # merge, tags, cover and telegram thumbnail in one ffmpeg run, see SinglePassPP
+            "writethumbnail": True,
+            "single_pass": True,
         }
-        # setup cookies for youtube
-        if is_youtube(self._url):
-            if browsers := os.getenv("BROWSERS"):
-                ydl_opts["cookiesfrombrowser"] = browsers.split(",")
-            if os.path.isfile("youtube-cookies.txt") and os.path.getsize("youtube-cookies.txt") > 100:
-                ydl_opts["cookiefile"] = "youtube-cookies.txt"
-            if potoken := os.getenv("POTOKEN"):
-                ydl_opts["extractor_args"] = {"youtube": ["player-client=web,default", f"po_token=web+{potoken}"]}
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(self._url, download=False)
-
-        # 获取视频时长用于估算文件大小
-        duration = info.get("duration", 0)
-
-        # 过滤并整理格式信息
-        formats = []
-        for f in info.get("formats", []):
-            height = f.get("height")
-            vcodec = f.get("vcodec", "none")
-            format_id = f.get("format_id", "")
-            protocol = f.get("protocol", "")
-
-            # 只保留有视频的格式
-            if height and vcodec != "none":
-                filesize = f.get("filesize") or f.get("filesize_approx", 0)
-                # 如果没有文件大小，尝试通过比特率和时长估算
-                if not filesize and duration:
-                    tbr = f.get("tbr", 0)  # 总比特率 kbps
-                    if tbr:
-                        filesize = int(tbr * 1000 / 8 * duration)  # 估算字节数
-                formats.append({
-                    "format_id": f["format_id"],
-                    "height": height,
-                    "ext": f.get("ext", "mp4"),
-                    "filesize": filesize,
-                    "vcodec": vcodec,
-                })
-
-        # 去重并按分辨率排序（只保留每个分辨率的最佳格式）
-        seen = set()
-        unique_formats = []
-        for f in sorted(formats, key=lambda x: (x["height"], x["filesize"] or 0), reverse=True):
-            if f["height"] not in seen:
-                seen.add(f["height"])
-                unique_formats.append(f)
-
-        result = unique_formats[:6]  # 最多返回6个选项
+        if RANGE_CONNECTIONS > 1:
+            # only applies to plain http(s) formats, dash and hls fragments and youtube keep the native downloader
+            profile["external_downloader"] = {"http": RANGED_DOWNLOADER}
+        # cookies and po token for youtube only, rotated by the credential provider
+        self._credential = credentials.acquire(self._url)
+        if self._credential:
+            profile.update(self._credential.options())
+        return profile
+
+    def _checkout(self, **job):
+        profile = self._profile()
+        if is_youtube(self._url) and (clients := extraction.client_order()):
+            # downloads extract in this process, use the player client that won the recent races
+            profile = with_clients(profile, clients[:1])
+        return pool.checkout(profile, self._credential.jar if self._credential else None, **job)
+
+    def get_available_formats(self) -> list[dict]:
+        """使用 yt-dlp extract_info 获取视频可用格式列表"""
+        profile = self._profile()
+        try:
+            info = extraction.extract(self._url, profile, self._credential)
+        except Exception as e:
+            credentials.report(self._credential, e)
+            raise
+
+        # 和下载时使用同一个规划器，只列出能发送到 Telegram 的组合
+        result = plan_choices(info)
         logging.info(f"Available formats: {[(f['format_id'], f['height']) for f in result]}")
         return result
 
@@ -144,37 +173,22 @@ class YoutubeDownload(BaseDownloader):
             formats.extend(defaults)
         return formats
 
+    def _progress(self, d: dict):
+        self._lease.observe(d)
+        d["_fragments_str"] = str(self._lease.concurrency)
+        self.download_hook(d)
+
     def _download(self, formats) -> list:
         output = Path(self._tempdir.name, "%(title).70s.%(ext)s").as_posix()
-        ydl_opts = {
-            "progress_hooks": [lambda d: self.download_hook(d)],
+        job_opts = {
+            "progress_hooks": [self._progress],
             "outtmpl": output,
-            "restrictfilenames": False,
-            "quiet": True,
             "match_filter": match_filter,
-            "concurrent_fragments": 16,
-            "buffersize": 4194304,
-            "retries": 6,
-            "fragment_retries": 6,
-            "skip_unavailable_fragments": True,
-            "embed_metadata": True,
-            "embed_thumbnail": True,
-            "writethumbnail": False,
         }
-        # setup cookies for youtube only
-        if is_youtube(self._url):
-            # use cookies from browser firstly
-            if browsers := os.getenv("BROWSERS"):
-                ydl_opts["cookiesfrombrowser"] = browsers.split(",")
-            if os.path.isfile("youtube-cookies.txt") and os.path.getsize("youtube-cookies.txt") > 100:
-                ydl_opts["cookiefile"] = "youtube-cookies.txt"
-            # try add extract_args if present
-            if potoken := os.getenv("POTOKEN"):
-                ydl_opts["extractor_args"] = {"youtube": ["player-client=web,default", f"po_token=web+{potoken}"]}
-                # for new version? https://github.com/yt-dlp/yt-dlp/wiki/PO-Token-Guide
-                # ydl_opts["extractor_args"] = {
-                #     "youtube": [f"po_token=web.player+{potoken}", f"po_token=web.gvs+{potoken}"]
-                # }
+        if self._clip:
+            # cut with stream copy at the nearest keyframes, no re-encoding
+            job_opts["download_ranges"] = download_range_func(None, [self._clip])
+            job_opts["force_keyframes_at_cuts"] = False
 
         if self._url.startswith("https://drive.google.com"):
             # Always use the `source` format for Google Drive URLs.
@@ -182,29 +196,79 @@ class YoutubeDownload(BaseDownloader):
 
         files = None
         last_error = None
-        for f in formats:
-            ydl_opts["format"] = f
-            logging.info("yt-dlp options: %s", ydl_opts)
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([self._url])
-                files = list(Path(self._tempdir.name).glob("*"))
-                if files:
-                    break  # 下载成功，退出循环
-            except Exception as e:
-                logging.warning(f"Format {f} failed: {e}, trying next format...")
-                last_error = e
-                continue
-
-        if not files and last_error:
-            raise last_error
+        self._lease = tuner.acquire(f"{self._chat_id}:{self._id}", job_opts)
+        try:
+            with self._checkout(**job_opts) as ydl:
+                # the tuner keeps adjusting the live params while downloading
+                self._lease.bind(ydl.params)
+                # extract once, every fallback format is evaluated against the same info dict
+                info = ydl.extract_info(self._url, download=False)
+                ie_key = info.get("extractor_key") or "Generic"
+                # a clip is only this part of the whole file
+                ratio = (self._clip[1] - self._clip[0]) / info["duration"] if self._clip and info.get("duration") else 1
+                learned = set()
+                if self._plan:
+                    formats = order_formats(self._redis.get_format_stats(ie_key).get(ie_key, {}), formats)
+                    # clips would skew the latency statistics
+                    learned = set() if self._clip else set(formats)
+                    if self._format != "audio":
+                        planned = plan_formats(info, self._quality, self._format, limit=int(TG_NORMAL_MAX_SIZE / ratio))
+                        formats = [p["format_id"] for p in planned[:2]] + formats
+                for f in formats:
+                    if not (selected := select_formats(ydl, info, f)):
+                        logging.info("Format %s is not available, trying next format...", f)
+                        if f in learned:
+                            self._redis.record_format(ie_key, f or "default", False)
+                        continue
+                    if estimate_selection(selected[0], info.get("duration")) * ratio > TG_NORMAL_MAX_SIZE:
+                        logging.info("Format %s is too large for Telegram, trying next format...", f)
+                        continue
+                    key = store_key(ie_key, info["id"], selected[0]["format_id"], self._clip)
+                    if stored := media_store.fetch(key, self._tempdir.name):
+                        # downloaded before by the bot or the web, the thumbnail comes along
+                        files = [p for p in stored if not is_thumb(p)]
+                        break
+                    ydl.params["format"] = f
+                    ydl.format_selector = ydl.build_format_selector(f) if f else None
+                    started = time.time()
+                    try:
+                        ydl.process_ie_result(dict(info), download=True)
+                        files = [p for p in Path(self._tempdir.name).glob("*") if not is_thumb(p)]
+                        if files:
+                            media_store.publish(key, list(Path(self._tempdir.name).glob("*")))
+                            if f in learned:
+                                self._redis.record_format(ie_key, f or "default", True, time.time() - started)
+                            break  # 下载成功，退出循环
+                    except Exception as e:
+                        logging.warning(f"Format {f} failed: {e}, trying next format...")
+                        last_error = e
+                        credentials.report(self._credential, e)
+                        if f in learned:
+                            self._redis.record_format(ie_key, f or "default", False)
+                        # drop partial files so they are not mistaken for the next format's result
+                        for leftover in Path(self._tempdir.name).glob("*"):
+                            leftover.unlink(missing_ok=True)
+        except Exception as e:
+            credentials.report(self._credential, e)
+            raise
+        finally:
+            self._lease.release()
+
+        if not files:
+            raise last_error or ValueError("Requested format is not available.")
 
         return files
 
     def _start(self, user_format_id=None, user_height=None):
         # start download and upload, no cache hit
         # user can choose format by clicking on the button(custom config)
-        if user_height:
+        if user_format_id and "+" in user_format_id:
+            # 规划器给出的明确组合（视频+音频），按高度兜底
+            formats = [user_format_id]
+            if user_height:
+                formats.append(f"bestvideo[height<=?{user_height}]+bestaudio/best[height<=?{user_height}]")
+            logging.info(f"Using planned format: {formats}")
+        elif user_height:
             # 使用 <=? 可选过滤器，如果没有匹配格式会自动 fallback
             # 参考: https://github.com/yt-dlp/yt-dlp#format-selection
             formats = [
@@ -217,6 +281,7 @@ class YoutubeDownload(BaseDownloader):
             logging.info(f"Using user-selected format: {formats}")
         else:
             formats = self._setup_formats()
+            self._plan = True
             logging.info(f"Using default format settings: {formats}")
         self._download(formats)
         self._upload()
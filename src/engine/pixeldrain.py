@@ -5,37 +5,158 @@
 
 __author__ = "SanujaNS <sanujas@sanuja.biz>"
 
-import tempfile
-import pathlib
+import json
+import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from urllib.parse import urlparse
+
+import filetype
+import requests
+from pyrogram import enums, types
+
+from config import PIXELDRAIN_API, PIXELDRAIN_WORKERS, TG_NORMAL_MAX_SIZE
+from engine.base import BaseDownloader, generate_input_media
 from engine.direct import DirectDownload
+from utils import sizeof_fmt
 
+FILE_PATTERN = re.compile(r"^/(?:u|file|api/file)/(\w+)")
+LIST_PATTERN = re.compile(r"^/(?:l|api/list)/(\w+)")
+# telegram accepts at most 10 items in one media group
+MEDIA_GROUP_SIZE = 10
+
+
+def _api_get(path: str) -> dict:
+    resp = requests.get(f"{PIXELDRAIN_API.rstrip('/')}/{path}", timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _file_url(file_id: str) -> str:
+    return f"{PIXELDRAIN_API.rstrip('/')}/file/{file_id}?download"
+
+
+def _too_large(item: dict) -> bool:
+    return item.get("size", 0) > TG_NORMAL_MAX_SIZE
+
+
+def _check_size(item: dict):
+    if _too_large(item):
+        raise ValueError(f"{item.get('name', item['id'])} is {sizeof_fmt(item['size'])}, too large for Telegram.")
 
-def pixeldrain_download(client, bot_message, url):
-    FILE_URL_FORMAT = "https://pixeldrain.com/api/file/{}?download"
-    USER_PAGE_PATTERN = re.compile(r"https://pixeldrain.com/u/(\w+)")
 
-    def _extract_file_id(url):
-        if match := USER_PAGE_PATTERN.match(url):
-            return match.group(1)
+class PixeldrainAlbumDownload(BaseDownloader):
+    """Download a pixeldrain list with a bounded pool and send it as media groups."""
 
-        parsed = urlparse(url)
-        if parsed.path.startswith('/file/'):
-            return parsed.path.split('/')[-1]
+    def __init__(self, client, bot_msg, url: str, files: list[dict]):
+        super().__init__(client, bot_msg, url)
+        self._items = files
+        self._done = 0
+        self._lock = threading.Lock()
 
-        raise ValueError("Invalid Pixeldrain URL format")
+    def _setup_formats(self) -> list | None:
+        pass
 
-    def _get_download_url(file_id):
-        return FILE_URL_FORMAT.format(file_id)
+    def _fetch(self, index: int, item: dict) -> str:
+        # prefix with index so files with the same name don't collide and keep the album order
+        name = f"{index:03d}-{Path(item.get('name') or item['id']).name}"
+        path = Path(self._tempdir.name, name)
+        with requests.get(_file_url(item["id"]), stream=True, timeout=60) as resp:
+            resp.raise_for_status()
+            with open(path, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
 
+        with self._lock:
+            self._done += 1
+            self.edit_text(f"Downloading album... {self._done}/{len(self._items)} files")
+        return path.as_posix()
+
+    def _download(self, formats=None) -> list:
+        with ThreadPoolExecutor(max_workers=PIXELDRAIN_WORKERS, thread_name_prefix="pixeldrain") as pool:
+            return list(pool.map(self._fetch, range(len(self._items)), self._items))
+
+    @staticmethod
+    def _group_media(files: list, caption: str) -> list:
+        # a media group can't mix documents with photos and videos
+        if all(filetype.guess_mime(f) and filetype.guess_mime(f).split("/")[0] in ("image", "video") for f in files):
+            return generate_input_media(files, caption)
+        media = [types.InputMediaDocument(media=f) for f in files]
+        media[0].caption = caption
+        return media
+
+    def _send_group(self, media: list) -> list:
+        if len(media) > 1:
+            return self._client.send_media_group(self._chat_id, media)
+        # a media group needs at least 2 items, a lone file is sent on its own
+        item = media[0]
+        kind = {types.InputMediaPhoto: "photo", types.InputMediaVideo: "video"}.get(type(item), "document")
+        return [self._methods[kind](self._chat_id, item.media, caption=item.caption)]
+
+    def _upload(self, files=None, meta=None):
+        caption = f"{self._url}\n{len(self._items)} files"
+        if meta and meta.get("cache"):
+            # cached albums store (media type, file id) pairs
+            kinds = {"photo": types.InputMediaPhoto, "video": types.InputMediaVideo}
+            cached = files
+            groups = [cached[i : i + MEDIA_GROUP_SIZE] for i in range(0, len(cached), MEDIA_GROUP_SIZE)]
+            for group in groups:
+                media = [kinds.get(kind, types.InputMediaDocument)(media=file_id) for kind, file_id in group]
+                media[0].caption = caption
+                self._send_group(media)
+            self._bot_msg.edit_text("✅ Success")
+            return
+
+        sent = []
+        for i in range(0, len(files), MEDIA_GROUP_SIZE):
+            self._client.send_chat_action(self._chat_id, enums.ChatAction.UPLOAD_DOCUMENT)
+            messages = self._send_group(self._group_media(files[i : i + MEDIA_GROUP_SIZE], caption))
+            for m in messages:
+                obj, kind = (m.photo, "photo") if m.photo else (m.video, "video") if m.video else (m.document, "document")
+                sent.append([kind, getattr(obj, "file_id", None)])
+
+        mapping = {"file_id": json.dumps(sent), "meta": json.dumps({"caption": caption}, ensure_ascii=False)}
+        self._redis.add_cache(self._calc_video_key(), mapping)
+        self._bot_msg.edit_text("✅ Success")
+
+    def _start(self):
+        downloaded_files = self._download()
+        self._upload(files=downloaded_files)
+
+
+def pixeldrain_download(client, bot_message, url):
     def _download(url):
         try:
-            file_id = _extract_file_id(url)
-            download_url = _get_download_url(file_id)
-
-            ddl = DirectDownload(client, bot_message, download_url)
-            ddl.start()
+            path = urlparse(url).path
+            if match := LIST_PATTERN.match(path):
+                album = _api_get(f"list/{match.group(1)}")
+                files = [item for item in album.get("files", []) if not _too_large(item)]
+                skipped = [
+                    f"{item.get('name', item['id'])} ({sizeof_fmt(item['size'])})"
+                    for item in album.get("files", [])
+                    if _too_large(item)
+                ]
+                if skipped:
+                    logging.warning("Skipping pixeldrain files: %s", skipped)
+                if not files:
+                    raise ValueError("Too large for Telegram:\n" + "\n".join(skipped) if skipped else "This list is empty.")
+                PixeldrainAlbumDownload(client, bot_message, url, files).start()
+                if skipped:
+                    client.send_message(
+                        bot_message.chat.id,
+                        f"{len(skipped)} of {len(album['files'])} files are too large for Telegram and were skipped:\n"
+                        + "\n".join(skipped),
+                    )
+            elif match := FILE_PATTERN.match(path):
+                # look up size and name first, so oversize files are rejected before downloading anything
+                info = _api_get(f"file/{match.group(1)}/info")
+                _check_size(info)
+                ddl = DirectDownload(client, bot_message, _file_url(info["id"]), filename=info.get("name"))
+                ddl.start()
+            else:
+                raise ValueError("Invalid Pixeldrain URL format")
 
         except ValueError as e:
             bot_message.edit_text(f"Download failed!❌\n\n`{e}`")
@@ -45,4 +166,4 @@ def pixeldrain_download(client, bot_message, url):
                 "Please check your URL and try again."
             )
 
-    _download(url)
\ No newline at end of file
+    _download(url)
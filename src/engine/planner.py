@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - planner.py
+
+import logging
+
+from config import TG_NORMAL_MAX_SIZE
+
+# preferred height for each quality setting, None means the best available
+QUALITY_HEIGHT = {"high": None, "medium": 720, "low": 480}
+# muxing overhead when video and audio are merged
+OVERHEAD = 1.02
+
+
+def _has(codec: str | None) -> bool:
+    return codec not in (None, "none")
+
+
+def estimate_size(f: dict, duration: float) -> int:
+    """filesize, filesize_approx, or tbr × duration for a single format, 0 when unknown"""
+    if size := f.get("filesize") or f.get("filesize_approx"):
+        return int(size)
+    if (tbr := f.get("tbr")) and duration:
+        return int(tbr * 1000 / 8 * duration)
+    return 0
+
+
+def estimate_selection(selected: dict, duration: float) -> int:
+    """Estimated size of a format picked by yt-dlp's selector, merged formats included"""
+    if parts := selected.get("requested_formats"):
+        sizes = [estimate_size(f, duration) for f in parts]
+        return int(sum(sizes) * OVERHEAD) if all(sizes) else 0
+    return estimate_size(selected, duration)
+
+
+def is_streamable(video: dict, audio: dict | None) -> bool:
+    # telegram clients only stream h264 with aac in mp4
+    acodec = (audio or video).get("acodec") or ""
+    return (video.get("vcodec") or "").startswith(("avc", "h264")) and acodec.startswith("mp4a")
+
+
+def _combinations(info: dict, duration: float):
+    formats = info.get("formats") or []
+    videos = [f for f in formats if _has(f.get("vcodec")) and f.get("height")]
+    audios = [f for f in formats if not _has(f.get("vcodec")) and _has(f.get("acodec"))]
+    for video in videos:
+        if _has(video.get("acodec")):
+            yield video, None, estimate_size(video, duration)
+            continue
+        for audio in audios:
+            sizes = estimate_size(video, duration), estimate_size(audio, duration)
+            yield video, audio, int(sum(sizes) * OVERHEAD) if all(sizes) else 0
+
+
+def plan_formats(info: dict, quality: str = "high", send_type: str = "video", limit: int = TG_NORMAL_MAX_SIZE) -> list[dict]:
+    """
+    Rank video+audio combinations of an extracted info dict by quality preference,
+    Telegram streamability and estimated size, each with an explicit format id like `137+140`.
+    Combinations known to exceed the limit are dropped, ones of unknown size (filesize 0) are kept
+    after known ones of the same height, the download hook still stops them when they turn out too large.
+    """
+    duration = info.get("duration") or 0
+    target = QUALITY_HEIGHT.get(quality)
+    plans = []
+    for video, audio, size in _combinations(info, duration):
+        if size > limit:
+            continue
+        height = video["height"]
+        streamable = is_streamable(video, audio)
+        plans.append(
+            {
+                "format_id": f"{video['format_id']}+{audio['format_id']}" if audio else video["format_id"],
+                "height": height,
+                "ext": video.get("ext", "mp4"),
+                "filesize": size,
+                "vcodec": video.get("vcodec", "unknown"),
+                "streamable": streamable,
+                # within the preferred height first, then streamable (unless sent as document), higher, larger
+                "_rank": (
+                    target is None or height <= target,
+                    streamable or send_type == "document",
+                    height if target is None or height <= target else -height,
+                    size,
+                ),
+            }
+        )
+
+    plans.sort(key=lambda p: p["_rank"], reverse=True)
+    for p in plans:
+        p.pop("_rank")
+    logging.info("Planned formats: %s", [(p["format_id"], p["height"], p["filesize"]) for p in plans[:5]])
+    return plans
+
+
+def plan_choices(info: dict, limit: int = TG_NORMAL_MAX_SIZE, count: int = 6) -> list[dict]:
+    """Best plan for each height, used as the resolution keyboard"""
+    choices, seen = [], set()
+    for p in plan_formats(info, "high", "video", limit):
+        if p["height"] not in seen:
+            seen.add(p["height"])
+            choices.append(p)
+    return sorted(choices, key=lambda p: p["height"], reverse=True)[:count]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - pool.py
+
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import yt_dlp
+
+from config import YTDL_POOL_MAX_USES, YTDL_POOL_SIZE, YTDLP_CACHE_DIR
+from engine import ytcache
+from engine.postprocess import YoutubeDL
+
+# read by YoutubeDL.__init__ only, so they are applied to a warm instance by hand
+_HOOKS = {"progress_hooks": "_progress_hooks", "postprocessor_hooks": "_postprocessor_hooks", "post_hooks": "_post_hooks"}
+
+
+class _Warm:
+    __slots__ = ("ydl", "params", "uses")
+
+    def __init__(self, ydl: yt_dlp.YoutubeDL):
+        self.ydl = ydl
+        # params after YoutubeDL normalized them, restored after every job
+        self.params = dict(ydl.params)
+        self.uses = 0
+
+
+class YoutubeDLPool:
+    """
+    Warm YoutubeDL instances keyed by option profile (cookies, po token, proxy...).
+    A job checks one out with its own options applied on top, they are reset when it is returned.
+    At most `size` idle instances are kept, busy ones beyond that are closed on return.
+    """
+
+    def __init__(self, size: int, max_uses: int):
+        self.size = size
+        self.max_uses = max_uses
+        self._idle: OrderedDict[str, list[_Warm]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def _key(profile: dict) -> str:
+        return json.dumps(profile, sort_keys=True, default=repr)
+
+    def _take(self, key: str, profile: dict, cookiejar) -> _Warm:
+        with self._lock:
+            if warm := self._idle.get(key):
+                self._idle.move_to_end(key)
+                self.reused += 1
+                return warm.pop()
+            self.created += 1
+        # unset keeps yt-dlp's own default, an empty cachedir would be the working directory
+        ydl = YoutubeDL({**({"cachedir": YTDLP_CACHE_DIR} if YTDLP_CACHE_DIR else {}), **profile})
+        ytcache.install(ydl)
+        if cookiejar is not None:
+            # cookiejar is a cached property, a shared jar has to be in place before the first request
+            ydl.__dict__["cookiejar"] = cookiejar
+        return _Warm(ydl)
+
+    def _put(self, key: str, warm: _Warm):
+        closing = []
+        with self._lock:
+            if warm.uses >= self.max_uses:
+                closing.append(warm)
+            else:
+                self._idle.setdefault(key, []).append(warm)
+                self._idle.move_to_end(key)
+            # evict the least recently used profiles first
+            while sum(len(v) for v in self._idle.values()) > self.size:
+                oldest = next(iter(self._idle))
+                closing.append(self._idle[oldest].pop(0))
+                if not self._idle[oldest]:
+                    del self._idle[oldest]
+        for w in closing:
+            w.ydl.close()
+
+    @staticmethod
+    def _apply(ydl: yt_dlp.YoutubeDL, job: dict):
+        for name, value in job.items():
+            if name in _HOOKS:
+                setattr(ydl, _HOOKS[name], list(value))
+            elif name == "outtmpl":
+                ydl.params["outtmpl"] = value if isinstance(value, dict) else {"default": value}
+                ydl._parse_outtmpl()
+            elif name == "format":
+                ydl.params["format"] = value
+                ydl.format_selector = ydl.build_format_selector(value) if value else None
+            else:
+                ydl.params[name] = value
+
+    @staticmethod
+    def _reset(warm: _Warm):
+        ydl = warm.ydl
+        ydl.params.clear()
+        ydl.params.update(warm.params)
+        ydl.params["outtmpl"] = dict(warm.params["outtmpl"])
+        for attr in _HOOKS.values():
+            setattr(ydl, attr, [])
+        ydl.format_selector = None
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+
+    @contextmanager
+    def checkout(self, profile: dict, cookiejar=None, **job):
+        # profiles with a shared cookiejar carry a `credential` name that changes when the jar is reloaded
+        key = self._key(profile)
+        warm = self._take(key, profile, cookiejar)
+        warm.uses += 1
+        try:
+            self._apply(warm.ydl, job)
+            yield warm.ydl
+        finally:
+            self._reset(warm)
+            self._put(key, warm)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "idle": sum(len(v) for v in self._idle.values()),
+                "profiles": len(self._idle),
+                "created": self.created,
+                "reused": self.reused,
+            }
+
+
+pool = YoutubeDLPool(YTDL_POOL_SIZE, YTDL_POOL_MAX_USES)
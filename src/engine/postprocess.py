@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - postprocess.py
+
+import os
+from pathlib import Path
+
+import yt_dlp
+from yt_dlp.postprocessor import FFmpegMergerPP
+from yt_dlp.utils import prepend_extension
+
+# telegram thumbnail written next to the output, not a file to upload
+THUMB_SUFFIX = ".tgthumb.jpg"
+# containers that take a cover as an attached picture
+COVER_EXTS = ("mp4", "m4a", "m4v", "mov")
+METADATA = {"title": "title", "artist": "uploader", "date": "upload_date", "comment": "webpage_url"}
+
+
+def thumb_path(media: str | Path) -> Path:
+    return Path(media).with_suffix(THUMB_SUFFIX)
+
+
+def is_thumb(path: Path) -> bool:
+    return path.name.endswith(THUMB_SUFFIX)
+
+
+class SinglePassPP(FFmpegMergerPP):
+    """
+    Merge video and audio, write metadata tags, attach the cover and produce the telegram thumbnail
+    with a single ffmpeg run, streams are copied. `+faststart` is added by yt-dlp to every output.
+    Without anything to merge only the thumbnail is made, the media file is not rewritten.
+    """
+
+    @staticmethod
+    def _cover(info: dict) -> str | None:
+        thumbs = [t["filepath"] for t in info.get("thumbnails") or [] if t.get("filepath")]
+        return thumbs[-1] if thumbs and os.path.exists(thumbs[-1]) else None
+
+    @staticmethod
+    def _thumb_opts(stream: str) -> list:
+        # telegram wants a jpeg within 320px
+        scale = "scale='if(gt(iw,ih),320,-2)':'if(gt(iw,ih),-2,320)'"
+        return ["-map", stream, "-vf", scale, "-frames:v", "1", "-q:v", "4"]
+
+    def run(self, info):
+        filename = info["filepath"]
+        cover = self._cover(info)
+        parts = info.get("__files_to_merge")
+        if not parts:
+            if cover:
+                self.real_run_ffmpeg([(cover, [])], [(thumb_path(filename).as_posix(), self._thumb_opts("0:v:0"))])
+            return [cover] if cover else [], info
+
+        temp_filename = prepend_extension(filename, "temp")
+        args = ["-c", "copy"]
+        videos = audios = 0
+        for i, fmt in enumerate(info["requested_formats"]):
+            if fmt.get("acodec") != "none":
+                args.extend(["-map", f"{i}:a:0"])
+                if fmt["protocol"].startswith("m3u8") and self.get_audio_codec(fmt["filepath"]) == "aac":
+                    args.extend([f"-bsf:a:{audios}", "aac_adtstoasc"])
+                audios += 1
+            if fmt.get("vcodec") != "none":
+                args.extend(["-map", f"{i}:v:0"])
+                videos += 1
+        for key, field in METADATA.items():
+            if value := info.get(field):
+                args.extend(["-metadata", f"{key}={value}"])
+
+        inputs = [(path, []) for path in parts]
+        outputs = [(temp_filename, args)]
+        if cover:
+            inputs.append((cover, []))
+            stream = f"{len(parts)}:v:0"
+            if info["ext"] in COVER_EXTS:
+                args.extend(["-map", stream, f"-c:v:{videos}", "mjpeg", f"-disposition:v:{videos}", "attached_pic"])
+            outputs.append((thumb_path(filename).as_posix(), self._thumb_opts(stream)))
+
+        self.to_screen(f'Merging formats into "{filename}" in a single pass')
+        self.real_run_ffmpeg(inputs, outputs)
+        os.replace(temp_filename, filename)
+        return parts + ([cover] if cover else []), info
+
+
+class YoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that runs SinglePassPP in place of the merger when the `single_pass` param is set"""
+
+    def post_process(self, filename, info, files_to_move=None):
+        if self.params.get("single_pass"):
+            # the merger runs before the fixups, take its place
+            pps = info.get("__postprocessors") or []
+            merged = [SinglePassPP(self) if type(pp) is FFmpegMergerPP else pp for pp in pps]
+            info["__postprocessors"] = merged if merged != pps else [SinglePassPP(self), *pps]
+        return super().post_process(filename, info, files_to_move)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - ranged.py
+
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from yt_dlp.downloader import external
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+from config import RANGE_CONNECTIONS, RANGE_MAX_PER_HOST, RANGE_MIN_SIZE
+
+# name used in yt-dlp's external_downloader option
+RANGED_DOWNLOADER = "ytdlbot"
+PIECE_SIZE = 8 * 1024 * 1024
+
+
+class HostSlots:
+    """Share a connection cap per host between all running downloads."""
+
+    def __init__(self, cap: int):
+        self._cap = cap
+        self._used = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, host: str, want: int):
+        with self._lock:
+            granted = max(0, min(want, self._cap - self._used[host]))
+            self._used[host] += granted
+        try:
+            yield granted
+        finally:
+            with self._lock:
+                self._used[host] -= granted
+                if self._used[host] <= 0:
+                    del self._used[host]
+
+
+host_slots = HostSlots(RANGE_MAX_PER_HOST)
+
+
+class RangedHttpFD(HttpFD):
+    """
+    Download plain http(s) formats over several connections with Range requests.
+    Falls back to yt-dlp's native http downloader when the server doesn't support ranges,
+    the file is small, or the host has no free connections left.
+    """
+
+    @classmethod
+    def can_download(cls, info_dict, path=None):
+        # youtube throttles parallel connections, its formats keep yt-dlp's chunked requests (http_chunk_size)
+        chunked = (info_dict.get("downloader_options") or {}).get("http_chunk_size")
+        youtube = (info_dict.get("extractor_key") or "").startswith("Youtube")
+        return (
+            info_dict.get("protocol") in ("http", "https")
+            and not info_dict.get("fragments")
+            and not chunked
+            and not youtube
+        )
+
+    def _probe_size(self, url: str, headers: HTTPHeaderDict) -> int:
+        try:
+            with self.ydl.urlopen(Request(url, headers={**headers, "Range": "bytes=0-0"})) as resp:
+                content_range = resp.headers.get("Content-Range", "")
+                if resp.status != 206 or "/" not in content_range:
+                    return 0
+                total = content_range.rsplit("/", 1)[-1]
+                return int(total) if total.isdigit() else 0
+        except Exception as e:
+            logging.info("Range probe failed for %s: %s", url, e)
+            return 0
+
+    def real_download(self, filename, info_dict):
+        url = info_dict["url"]
+        headers = HTTPHeaderDict({"Accept-Encoding": "identity"}, info_dict.get("http_headers"))
+        if self.params.get("test") or info_dict.get("request_data") or "Range" in headers:
+            return super().real_download(filename, info_dict)
+
+        size = self._probe_size(url, headers)
+        if size < max(RANGE_MIN_SIZE, 1):
+            return super().real_download(filename, info_dict)
+
+        with host_slots.acquire(urlparse(url).hostname, RANGE_CONNECTIONS) as connections:
+            if connections < 2:
+                return super().real_download(filename, info_dict)
+            logging.info("Downloading %s with %s connections", filename, connections)
+            return self._ranged_download(filename, info_dict, headers, size, connections)
+
+    def _ranged_download(self, filename, info_dict, headers, size, connections) -> bool:
+        url = info_dict["url"]
+        tmpfilename = self.temp_name(filename)
+        with open(tmpfilename, "wb") as f:
+            f.truncate(size)
+
+        piece = max(PIECE_SIZE, math.ceil(size / (connections * 4)))
+        pieces = [(start, min(start + piece, size) - 1) for start in range(0, size, piece)]
+        retries = self.params.get("retries", 10)
+        block_size = self.params.get("buffersize", 1024 * 1024)
+        lock = threading.Lock()
+        state = {"downloaded": 0, "error": None}
+
+        def fetch(f, start, end):
+            pos = start
+            for attempt in range(retries + 1):
+                try:
+                    with self.ydl.urlopen(Request(url, headers={**headers, "Range": f"bytes={pos}-{end}"})) as resp:
+                        if resp.status != 206:
+                            raise OSError(f"server answered {resp.status} to a range request")
+                        f.seek(pos)
+                        while pos <= end and (chunk := resp.read(block_size)):
+                            if state["error"]:
+                                return
+                            f.write(chunk)
+                            pos += len(chunk)
+                            with lock:
+                                state["downloaded"] += len(chunk)
+                    if pos > end:
+                        return
+                    raise OSError(f"connection closed at byte {pos} of range {start}-{end}")
+                except Exception as e:
+                    if attempt == retries:
+                        raise
+                    logging.warning("Range %s-%s failed at %s: %s, retrying...", start, end, pos, e)
+
+        def worker():
+            with open(tmpfilename, "r+b") as f:
+                while not state["error"]:
+                    with lock:
+                        if not pieces:
+                            return
+                        start, end = pieces.pop(0)
+                    try:
+                        fetch(f, start, end)
+                    except Exception as e:
+                        state["error"] = state["error"] or e
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(connections)]
+        for t in threads:
+            t.start()
+
+        started = time.time()
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.5)
+                now, downloaded = time.time(), state["downloaded"]
+                self._hook_progress(
+                    {
+                        "status": "downloading",
+                        "downloaded_bytes": downloaded,
+                        "total_bytes": size,
+                        "tmpfilename": tmpfilename,
+                        "filename": filename,
+                        "eta": self.calc_eta(started, now, size, downloaded),
+                        "speed": self.calc_speed(started, now, downloaded),
+                        "elapsed": now - started,
+                    },
+                    info_dict,
+                )
+        except BaseException as e:
+            # a progress hook gave up, e.g. the file is too large for Telegram
+            state["error"] = state["error"] or e
+            raise
+        finally:
+            for t in threads:
+                t.join()
+
+        if state["error"]:
+            raise state["error"]
+
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress(
+            {
+                "status": "finished",
+                "downloaded_bytes": size,
+                "total_bytes": size,
+                "filename": filename,
+                "elapsed": time.time() - started,
+            },
+            info_dict,
+        )
+        return True
+
+
+# yt-dlp looks external downloaders up by name
+external._BY_NAME[RANGED_DOWNLOADER] = RangedHttpFD
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - router.py
+
+import functools
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, NamedTuple
+from urllib.parse import urlparse
+
+from yt_dlp.extractor import gen_extractor_classes
+
+# literal host names inside _VALID_URL, e.g. `(?:www\.)?youtube\.com`
+_DOMAIN_RE = re.compile(r"((?:[a-z0-9-]+\\\.)+[a-z]{2,})(?![a-z0-9-])")
+# simple alternations in front of a domain, e.g. `(?:twitter|x)\.com`
+_ALTERNATION_RE = re.compile(r"\(\?:((?:[a-z0-9-]+\|)+[a-z0-9-]+)\)((?:\\\.[a-z0-9-]+)+)")
+# hosts outside the index whose extractors were found by a full scan, and urls whose scan result is kept
+LEARNED_HOSTS = 1024
+SCANNED_URLS = 1024
+
+
+class Route(NamedTuple):
+    handler: Callable[[Any, Any, str], Any] | None  # special engine, None means yt-dlp
+    ie_key: str | None  # matched yt-dlp extractor, None means only the generic extractor is left
+
+
+def _host_suffixes(hostname: str) -> list[str]:
+    # www.m.example.co.uk -> www.m.example.co.uk, m.example.co.uk, example.co.uk, co.uk
+    labels = hostname.lower().rstrip(".").split(".")
+    return [".".join(labels[i:]) for i in range(len(labels) - 1)]
+
+
+def _pattern_domains(pattern: str) -> set[str]:
+    pattern = pattern.lower()
+    for _ in range(3):
+        pattern = _ALTERNATION_RE.sub(
+            lambda m: "(?:" + "|".join(alt + m.group(2) for alt in m.group(1).split("|")) + ")", pattern
+        )
+    return {d.replace("\\.", ".") for d in _DOMAIN_RE.findall(pattern)}
+
+
+class URLRouter:
+    """Send a URL to the right engine with a host name index instead of trying every extractor."""
+
+    def __init__(self, special: dict[str, Callable]):
+        self._special = special
+        self._index: dict[str, list[type]] = {}
+        self._extractors: dict[str, type] = {}
+        # only hints, tried before a full scan: suitable() depends on the whole url, not just the host
+        self._learned: OrderedDict[str, list[type]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._built = False
+        self._scan = functools.lru_cache(maxsize=SCANNED_URLS)(self._scan_all)
+
+    def build(self):
+        with self._lock:
+            if self._built:
+                return
+            start = time.time()
+            index = {}
+            for ie in gen_extractor_classes():
+                if ie.ie_key() == "Generic" or not ie._VALID_URL:
+                    continue
+                self._extractors[ie.ie_key()] = ie
+                patterns = ie._VALID_URL if isinstance(ie._VALID_URL, (list, tuple)) else [ie._VALID_URL]
+                for domain in set().union(*(_pattern_domains(p) for p in patterns)):
+                    index.setdefault(domain, []).append(ie)
+            self._index = index
+            self._built = True
+            logging.info("URL router indexed %s domains in %.2fs", len(index), time.time() - start)
+
+    def special(self, hostname: str) -> Callable | None:
+        for suffix in _host_suffixes(hostname):
+            if handler := self._special.get(suffix):
+                return handler
+        return None
+
+    def extractor(self, url: str) -> str | None:
+        if not self._built:
+            self.build()
+        hostname = (urlparse(url).hostname or "").lower()
+        suffixes = _host_suffixes(hostname)
+        for suffix in suffixes:
+            for ie in self._index.get(suffix, []):
+                if _suitable(ie, url):
+                    return ie.ie_key()
+        # extractors with wildcard or generic host patterns aren't in the index, even for indexed hosts
+        with self._lock:
+            hints = list(self._learned.get(hostname, []))
+        for ie in hints:
+            if _suitable(ie, url):
+                return ie.ie_key()
+        found = self._scan(url)
+        if found:
+            self._learn(hostname, self._extractors[found])
+        return found
+
+    def _scan_all(self, url: str) -> str | None:
+        # not every _VALID_URL can be parsed, urls the index can't place get a full scan, cached per url
+        found = next((ie for ie in self._extractors.values() if _suitable(ie, url)), None)
+        return found.ie_key() if found else None
+
+    def _learn(self, hostname: str, ie: type):
+        with self._lock:
+            hints = self._learned.setdefault(hostname, [])
+            if ie not in hints:
+                hints.append(ie)
+            self._learned.move_to_end(hostname)
+            while len(self._learned) > LEARNED_HOSTS:
+                self._learned.popitem(last=False)
+
+    def route(self, url: str) -> Route:
+        hostname = urlparse(url).hostname
+        if not hostname:
+            raise ValueError(f"Invalid URL format: {url}")
+        if handler := self.special(hostname):
+            return Route(handler, None)
+        return Route(None, self.extractor(url))
+
+
+@functools.lru_cache(maxsize=4096)
+def _suitable(ie: type, url: str) -> bool:
+    return ie.suitable(url)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - store.py
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from config import MEDIA_STORE_BYTES, MEDIA_STORE_DIR
+
+# held shared while an entry is linked out, exclusive while it's evicted
+LOCK = ".lock"
+
+
+def _link(src: Path, dst: Path):
+    # hard links cost nothing and survive the eviction of the source, copy across file systems
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def store_key(extractor: str, video_id: str, format_id: str, clip: tuple | None = None) -> str:
+    key = f"{extractor}:{video_id}:{format_id}"
+    return f"{key}:clip:{clip[0]:g}-{clip[1]:g}" if clip else key
+
+
+class MediaStore:
+    """
+    Downloaded files shared by the bot and the web, one directory per (extractor, video id, format id).
+    Entries are staged in `.staging` and published with a rename, so readers never see half an entry.
+    Least recently used entries are evicted once the store grows beyond `budget` bytes,
+    entries in use are locked and skipped. Several processes can share one store.
+
+    The sizes are kept in an index that is built with one scan of the tree on first use and then
+    follows this process's fetches, publishes and evictions. Entries published by another process
+    join it when they are fetched here, entries it removed drop out when they are met.
+    """
+
+    def __init__(self, root: str, budget: int):
+        self.root = Path(root or os.path.join(tempfile.gettempdir(), "media-store"))
+        self.budget = budget
+        self._lock = threading.Lock()
+        self.stats = {"hit": 0, "miss": 0, "publish": 0, "evict": 0, "evicted_bytes": 0}
+        # entry -> bytes, least recently used first
+        self._index: OrderedDict[Path, int] | None = None
+        self._bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _load(self) -> OrderedDict[Path, int]:
+        # caller holds self._lock
+        if self._index is None:
+            entries = []
+            for bucket in self.root.glob("*"):
+                if bucket.name.startswith(".") or not bucket.is_dir():
+                    continue
+                for entry in bucket.iterdir():
+                    try:
+                        size = sum(f.stat().st_size for f in entry.iterdir())
+                        entries.append((entry.stat().st_mtime, entry, size))
+                    except FileNotFoundError:
+                        continue  # evicted by another process meanwhile
+            self._index = OrderedDict((entry, size) for _, entry, size in sorted(entries))
+            self._bytes = sum(self._index.values())
+            # staging left behind by a crashed process
+            for staging in (self.root / ".staging").glob("*"):
+                if time.time() - staging.stat().st_mtime > 86400:
+                    shutil.rmtree(staging, ignore_errors=True)
+        return self._index
+
+    def _use(self, entry: Path, size: int):
+        """Record entry as the most recently used one"""
+        with self._lock:
+            index = self._load()
+            self._bytes += size - index.get(entry, 0)
+            index[entry] = size
+            index.move_to_end(entry)
+
+    def _forget(self, entry: Path):
+        with self._lock:
+            if self._index is not None and (size := self._index.pop(entry, None)) is not None:
+                self._bytes -= size
+
+    def fetch(self, key: str, dest: str) -> list[Path] | None:
+        """Link the files of an entry into dest, None on a miss"""
+        if not self.enabled:
+            return None
+        entry = self._path(key)
+        files, size = [], 0
+        try:
+            with open(entry / LOCK) as lock:
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                for item in entry.iterdir():
+                    if item.name != LOCK:
+                        size += item.stat().st_size
+                        # listed first, a copy that fails halfway is removed too
+                        files.append(Path(dest, item.name))
+                        _link(item, files[-1])
+                # recently used, evicted last, also by other processes
+                os.utime(entry)
+        except OSError as e:
+            # e.g. the entry went away meanwhile: the caller downloads into dest, half an entry must not be left there
+            for f in files:
+                f.unlink(missing_ok=True)
+            if not isinstance(e, FileNotFoundError):
+                logging.warning("Media store entry %s not fetched: %s", key, e)
+            self._forget(entry)
+            self._count("miss")
+            return None
+        self._use(entry, size)
+        self._count("hit")
+        logging.info("Media store hit for %s", key)
+        return files
+
+    def publish(self, key: str, files: list[Path]):
+        """Add files under key, they are linked so the caller keeps its own copies"""
+        if not self.enabled or not files:
+            return
+        entry = self._path(key)
+        staging = self.root / ".staging" / uuid.uuid4().hex
+        staging.mkdir(parents=True)
+        size = 0
+        try:
+            for f in files:
+                _link(Path(f), staging / Path(f).name)
+                size += Path(f).stat().st_size
+            (staging / LOCK).touch()
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(staging, entry)
+        except OSError as e:
+            # another process published the same entry first
+            logging.info("Media store entry %s not published: %s", key, e)
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self._use(entry, size)
+        self._count("publish")
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the store fits its budget"""
+        with self._lock:
+            index = self._load()
+            for entry, size in list(index.items()):
+                if self._bytes <= self.budget:
+                    break
+                try:
+                    with open(entry / LOCK) as lock:
+                        # entries being linked out are skipped
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        shutil.rmtree(entry)
+                    self.stats["evict"] += 1
+                    self.stats["evicted_bytes"] += size
+                except BlockingIOError:
+                    continue
+                except FileNotFoundError:
+                    pass  # already evicted by another process
+                del index[entry]
+                self._bytes -= size
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            index = self._load() if self.enabled else {}
+            size, entries = self._bytes, len(index)
+        lookups = stats["hit"] + stats["miss"]
+        return {
+            "dir": str(self.root),
+            "budget": self.budget,
+            "bytes": size,
+            "entries": entries,
+            "hit_ratio": round(stats["hit"] / lookups, 3) if lookups else 0,
+            **stats,
+        }
+
+
+media_store = MediaStore(MEDIA_STORE_DIR, MEDIA_STORE_BYTES)
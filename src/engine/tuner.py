@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - tuner.py
+
+import logging
+import threading
+import time
+
+import psutil
+
+from config import FRAGMENT_BUDGET, FRAGMENT_MAX, FRAGMENT_MIN, FRAGMENT_NIC_MBPS
+
+# seconds of progress used for one adjustment
+WINDOW = 5
+CPU_HIGH = 90
+NIC_HIGH = 0.95
+
+
+class FragmentLease:
+    """Fragment concurrency of one job, adjusted from its progress hooks."""
+
+    def __init__(self, tuner: "FragmentTuner", job_id: str, params: dict, concurrency: int):
+        self._tuner = tuner
+        self.job_id = job_id
+        self.params = params
+        self.concurrency = concurrency
+        self.throughput = 0.0
+        self._last_throughput = 0.0
+        self._window_start = time.time()
+        self._window_bytes = 0
+        self._seen: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._apply()
+
+    def bind(self, params: dict):
+        # follow the params of the YoutubeDL instance that is downloading now
+        self.params = params
+        self._apply()
+
+    def _apply(self):
+        # yt-dlp reads it whenever a stream starts downloading, e.g. the audio after the video
+        self.params["concurrent_fragment_downloads"] = self.concurrency
+
+    def observe(self, d: dict):
+        if d.get("status") != "downloading":
+            return
+        key = d.get("tmpfilename") or d.get("filename") or ""
+        downloaded = d.get("downloaded_bytes") or 0
+        with self._lock:
+            self._window_bytes += max(0, downloaded - self._seen.get(key, 0))
+            self._seen[key] = downloaded
+            elapsed = time.time() - self._window_start
+            if elapsed < WINDOW:
+                return
+            self.throughput = self._window_bytes / elapsed
+            self._window_bytes, self._window_start = 0, time.time()
+        self._tuner.adjust(self)
+
+    def release(self):
+        self._tuner.release(self)
+
+
+class FragmentTuner:
+    """
+    AIMD controller for yt-dlp fragment concurrency. Jobs share a global budget,
+    each one grows by one while its throughput improves and halves on congestion
+    (throughput drop, busy CPU or saturated NIC).
+    """
+
+    def __init__(self, budget: int, lower: int, upper: int, nic_mbps: int = 0):
+        self.budget = budget
+        self.lower = lower
+        self.upper = upper
+        self.nic_capacity = nic_mbps * 1024 * 1024 / 8
+        self._leases: dict[str, FragmentLease] = {}
+        self._lock = threading.Lock()
+        self._cpu = 0.0
+        self._nic = 0.0
+        self._sampled = 0.0
+        self._net_bytes = psutil.net_io_counters().bytes_recv
+
+    @property
+    def in_use(self) -> int:
+        return sum(lease.concurrency for lease in self._leases.values())
+
+    def acquire(self, job_id: str, params: dict) -> FragmentLease:
+        with self._lock:
+            share = self.budget // (len(self._leases) + 1)
+            concurrency = max(self.lower, min(self.upper, share, self.budget - self.in_use))
+            lease = FragmentLease(self, job_id, params, concurrency)
+            self._leases[job_id] = lease
+        logging.info("Job %s starts with %s concurrent fragments", job_id, concurrency)
+        return lease
+
+    def release(self, lease: FragmentLease):
+        with self._lock:
+            self._leases.pop(lease.job_id, None)
+
+    def _sample(self):
+        now = time.time()
+        if now - self._sampled < 1:
+            return
+        self._cpu = psutil.cpu_percent(interval=None)
+        net_bytes = psutil.net_io_counters().bytes_recv
+        if self.nic_capacity and self._sampled:
+            self._nic = (net_bytes - self._net_bytes) / (now - self._sampled) / self.nic_capacity
+        self._net_bytes, self._sampled = net_bytes, now
+
+    def adjust(self, lease: FragmentLease):
+        with self._lock:
+            self._sample()
+            old = lease.concurrency
+            congested = self._cpu > CPU_HIGH or self._nic > NIC_HIGH or lease.throughput < lease._last_throughput * 0.9
+            if congested:
+                lease.concurrency = max(self.lower, old // 2)
+            elif lease.throughput > lease._last_throughput * 1.05 and old < self.upper and self.in_use < self.budget:
+                lease.concurrency = old + 1
+            lease._last_throughput = lease.throughput
+            lease._apply()
+        if lease.concurrency != old:
+            logging.info(
+                "Job %s fragments %s -> %s, %.1f KiB/s, cpu %s%%",
+                lease.job_id, old, lease.concurrency, lease.throughput / 1024, self._cpu,
+            )
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "in_use": self.in_use,
+                "cpu": self._cpu,
+                "nic": round(self._nic, 3),
+                "jobs": {
+                    job_id: {"fragments": lease.concurrency, "throughput": int(lease.throughput)}
+                    for job_id, lease in self._leases.items()
+                },
+            }
+
+
+tuner = FragmentTuner(FRAGMENT_BUDGET, FRAGMENT_MIN, FRAGMENT_MAX, FRAGMENT_NIC_MBPS)
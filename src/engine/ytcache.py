@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - ytcache.py
+
+import fcntl
+import logging
+import threading
+import time
+from pathlib import Path
+
+import yt_dlp
+from yt_dlp.cache import Cache
+
+from config import YTDLP_CACHE_DIR, YTDLP_WARM_URL
+from database import Redis
+
+_MISS = object()
+
+
+class CountingCache(Cache):
+    """
+    yt-dlp's file cache (player js, signature functions...) with hit/miss counters per section.
+    The counters are kept in redis, most lookups happen in the extraction worker processes.
+    """
+
+    _redis: Redis | None = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def redis(cls) -> Redis:
+        with cls._lock:
+            cls._redis = cls._redis or Redis()
+            return cls._redis
+
+    def _count(self, section: str, name: str):
+        try:
+            self.redis().count_ytdlp_cache(section, name)
+        except Exception as e:
+            # statistics never fail an extraction
+            logging.debug("Can't count yt-dlp cache %s: %s", name, e)
+
+    def load(self, section, key, dtype="json", default=None, *, min_ver=None):
+        data = super().load(section, key, dtype, _MISS, min_ver=min_ver)
+        if not self.enabled:
+            return default
+        self._count(section, "miss" if data is _MISS else "hit")
+        return default if data is _MISS else data
+
+    def store(self, section, key, data, dtype="json"):
+        # yt-dlp writes to a temporary file and renames it, so concurrent processes never read half a file
+        super().store(section, key, data, dtype)
+        if self.enabled:
+            self._count(section, "store")
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        stats = cls.redis().get_ytdlp_cache_stats()
+        total = {"hit": 0, "miss": 0, "store": 0}
+        for counter in stats.values():
+            for name, value in counter.items():
+                total[name] += value
+        return {"dir": YTDLP_CACHE_DIR, **total, "sections": stats}
+
+
+def install(ydl: yt_dlp.YoutubeDL):
+    ydl.cache = CountingCache(ydl)
+
+
+def warm_cache(url: str = YTDLP_WARM_URL):
+    """
+    Resolve the current YouTube player once, so its js and deciphered functions are in the cache before the first job.
+    Processes starting together take turns, the ones waiting find everything cached.
+    """
+    if not url:
+        return
+    # the pool installs CountingCache on its instances, import it lazily
+    from engine.credentials import credentials
+    from engine.pool import pool
+
+    start = time.time()
+    try:
+        cred = credentials.acquire(url)
+        profile = {"quiet": True, "no_warnings": True, **(cred.options() if cred else {})}
+        with pool.checkout(profile, cred.jar if cred else None) as ydl:
+            # the directory the pooled instances really use, yt-dlp's default when YTDLP_CACHE_DIR is unset
+            root = Path(ydl.cache._get_root_dir())
+            root.mkdir(parents=True, exist_ok=True)
+            with open(root / ".warm.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    ydl.extract_info(url, download=False)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        logging.info("yt-dlp cache warmed in %.2fs: %s", time.time() - start, CountingCache.snapshot())
+    except Exception as e:
+        logging.warning("Failed to warm yt-dlp cache: %s", e)
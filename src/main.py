@@ -18,7 +18,6 @@ from typing import Any
 
 import psutil
 import pyrogram.errors
-import yt_dlp
 from apscheduler.schedulers.background import BackgroundScheduler
 from pyrogram import Client, enums, filters, types
 
@@ -50,10 +49,14 @@ from database.model import (
     reset_free,
     set_user_settings,
 )
-from engine import direct_entrance, youtube_entrance, special_download_entrance
+from engine import clip_entrance, direct_entrance, router, youtube_entrance, special_download_entrance
+from engine.direct import DirectDownload, probe_direct_link
 from engine.generic import YoutubeDownload
+from engine.store import media_store
+from engine.tuner import tuner
+from engine.ytcache import CountingCache, warm_cache
 from database import Redis
-from utils import extract_url_and_name, sizeof_fmt, timeof_fmt
+from utils import extract_url_and_name, parse_time_range, sizeof_fmt, timeof_fmt
 
 logging.info("Authorized users are %s", AUTHORIZED_USER)
 logging.getLogger("apscheduler.executors.default").propagate = False
@@ -228,6 +231,9 @@ def stats_handler(client: Client, message: types.Message):
     swap = psutil.swap_memory()
     memory = psutil.virtual_memory()
     boot_time = psutil.boot_time()
+    fragments = tuner.snapshot()
+    ytcache = CountingCache.snapshot()
+    store = media_store.snapshot()
 
     owner_stats = (
         "\n\n⌬─────「 Stats 」─────⌬\n\n"
@@ -244,6 +250,10 @@ def stats_handler(client: Client, message: types.Message):
         f"<b>Used:</b> {sizeof_fmt(used)} | <b>Free:</b> {sizeof_fmt(free)}\n\n"
         f"<b>Physical Cores:</b> {psutil.cpu_count(logical=False)}\n"
         f"<b>Total Cores:</b> {psutil.cpu_count(logical=True)}\n\n"
+        f"<b>Fragments:</b> {fragments['in_use']}/{fragments['budget']} in {len(fragments['jobs'])} jobs\n"
+        f"<b>yt-dlp Cache:</b> {ytcache['hit']} hits | {ytcache['miss']} misses\n"
+        f"<b>Media Store:</b> {sizeof_fmt(store['bytes'])} in {store['entries']} entries | "
+        f"{store['hit']} hits | {store['miss']} misses | {store['evict']} evicted\n\n"
         f"<b>🤖Bot Uptime:</b> {timeof_fmt(time.time() - botStartTime)}\n"
         f"<b>⏲️OS Uptime:</b> {timeof_fmt(time.time() - boot_time)}\n"
     )
@@ -269,6 +279,19 @@ def stats_handler(client: Client, message: types.Message):
         message.reply_text(user_stats, quote=True)
 
 
+@app.on_message(filters.command(["formats"]) & filters.user(OWNER))
+def formats_handler(client: Client, message: types.Message):
+    # learned format fallback order per extractor, see engine.generic.order_formats
+    lines = []
+    for extractor, stats in Redis().get_format_stats().items():
+        lines.append(f"<b>{extractor}</b>")
+        for selector, stat in sorted(stats.items(), key=lambda x: -x[1]["ok"] / (x[1]["ok"] + x[1]["fail"] or 1)):
+            total = stat["ok"] + stat["fail"]
+            rate = stat["ok"] / total * 100 if total else 0
+            lines.append(f"`{selector}`\n  {rate:.0f}% of {total:.1f} | {stat['time']:.1f}s")
+    message.reply_text("\n".join(lines) or "No format statistics yet.", quote=True)
+
+
 @app.on_message(filters.command(["settings"]))
 def settings_handler(client: Client, message: types.Message):
     chat_id = message.chat.id
@@ -344,6 +367,35 @@ def spdl_handler(client: Client, message: types.Message):
         return
 
 
+@app.on_message(filters.command(["clip"]))
+def clip_handler(client: Client, message: types.Message):
+    chat_id = message.chat.id
+    init_user(chat_id)
+    client.send_chat_action(chat_id, enums.ChatAction.TYPING)
+    lang = get_language_settings(chat_id)
+    # /clip URL start-end
+    args = message.text.split()
+    if len(args) != 3 or not re.findall(r"^https?://", args[1].lower()):
+        message.reply_text(get_text("clip_usage", lang), quote=True)
+        return
+    url = args[1]
+    try:
+        clip = parse_time_range(args[2])
+    except ValueError as e:
+        message.reply_text(f"{e}\n\n{get_text('clip_usage', lang)}", quote=True)
+        return
+    logging.info("clip start %s %s", url, clip)
+    bot_msg = message.reply_text(get_text("clip_received", lang).format(*args[2].split("-", 1)), quote=True)
+    try:
+        clip_entrance(client, bot_msg, url, clip)
+    except ValueError as e:
+        message.reply_text(e.__str__(), quote=True)
+        bot_msg.delete()
+    except Exception as e:
+        logging.error("Clip download failed", exc_info=True)
+        bot_msg.edit_text(f"❌ {get_text('download_failed', lang)}: {e}")
+
+
 @app.on_message(filters.command(["ytdl"]) & filters.group)
 def ytdl_handler(client: Client, message: types.Message):
     # for group only
@@ -368,7 +420,6 @@ def ytdl_handler(client: Client, message: types.Message):
 
 
 def check_link(url: str):
-    ytdl = yt_dlp.YoutubeDL()
     if re.findall(r"^https://www\.youtube\.com/channel/", url) or "list" in url:
         # TODO maybe using ytdl.extract_info
         raise ValueError("Playlist or channel download are not supported at this moment.")
@@ -405,6 +456,19 @@ def download_handler(client: Client, message: types.Message):
 
     try:
         check_link(url)
+        route = router.route(url)
+        if route.handler:
+            # pixeldrain, krakenfiles etc. don't need /spdl, and shouldn't go through yt-dlp's generic extractor
+            bot_msg: types.Message | Any = message.reply_text(get_text("spdl_received", lang), quote=True)
+            route.handler(client, bot_msg, url)
+            return
+
+        if route.ie_key is None and (probe := probe_direct_link(url)):
+            # plain media or binary file, yt-dlp would only download and sniff it
+            bot_msg = message.reply_text(get_text("direct_download_received", lang), quote=True)
+            DirectDownload(client, bot_msg, url, filename=probe["filename"]).start()
+            return
+
         bot_msg: types.Message | Any = message.reply_text(get_text("analyzing_video", lang), quote=True)
 
         # 尝试获取可用格式
@@ -426,10 +490,11 @@ def download_handler(client: Client, message: types.Message):
                     ext = f.get("ext", "mp4").upper()
                     label = f"{f['height']}p | {vcodec} | {ext} | {size_str}"
                     # callback_data 格式: fmt_{format_id}_{height}_{msg_id}
-                    buttons.append(types.InlineKeyboardButton(
-                        label,
-                        callback_data=f"fmt_{f['format_id']}_{f['height']}_{bot_msg.id}"
-                    ))
+                    data = f"fmt_{f['format_id']}_{f['height']}_{bot_msg.id}"
+                    if len(data.encode()) > 64:
+                        # telegram 限制 64 字节，过长的组合只传高度
+                        data = f"fmt__{f['height']}_{bot_msg.id}"
+                    buttons.append(types.InlineKeyboardButton(label, callback_data=data))
 
                 # 每行2个按钮
                 markup_rows = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
@@ -581,6 +646,8 @@ def start_web_server():
 
 if __name__ == "__main__":
     botStartTime = time.time()
+    router.build()
+    threading.Thread(target=warm_cache, daemon=True).start()
     scheduler = BackgroundScheduler()
     scheduler.add_job(reset_free, "cron", hour=0, minute=0)
     scheduler.start()
@@ -12,7 +12,7 @@ import tempfile
 import time
 import uuid
 from http.cookiejar import MozillaCookieJar
-from urllib.parse import quote_plus, urlparse
+from urllib.parse import parse_qs, parse_qsl, quote_plus, urlencode, urlparse, urlunparse
 
 import ffmpeg
 
@@ -35,6 +35,30 @@ def timeof_fmt(seconds: int | float):
     return result
 
 
+def parse_timestamp(text: str) -> float:
+    # 1:02:03.5, 62:03 or 3723
+    parts = text.strip().split(":")
+    if not 1 <= len(parts) <= 3 or not all(parts):
+        raise ValueError(f"Invalid time: {text}")
+    seconds = 0.0
+    for i, part in enumerate(parts):
+        value = float(part)
+        if value < 0 or (i and value >= 60):
+            raise ValueError(f"Invalid time: {text}")
+        seconds = seconds * 60 + value
+    return seconds
+
+
+def parse_time_range(text: str) -> tuple[float, float]:
+    start, sep, end = text.strip().partition("-")
+    if not sep:
+        raise ValueError(f"Invalid time range: {text}, use start-end like 1:30-2:00")
+    start, end = parse_timestamp(start), parse_timestamp(end)
+    if end <= start:
+        raise ValueError(f"Invalid time range: {text}, end must be after start")
+    return start, end
+
+
 def is_youtube(url: str) -> bool:
     try:
         if not url or not isinstance(url, str):
@@ -47,6 +71,27 @@ def is_youtube(url: str) -> bool:
         return False
 
 
+# query parameters that don't change which video a link points to
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|si|feature|fbclid|gclid|igshid|ref|ref_src|pp)$")
+YOUTUBE_ID = re.compile(r"^[\w-]{11}$")
+
+
+def canonical_id(url: str) -> str:
+    """youtube:<video id> for youtube links, otherwise the url without fragment and tracking parameters"""
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    if host in {"youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be"}:
+        query = parse_qs(parsed.query)
+        path = parsed.path.strip("/").split("/")
+        video_id = path[0] if host == "youtu.be" else query.get("v", [""])[0]
+        if not video_id and len(path) == 2 and path[0] in ("shorts", "embed", "live", "v"):
+            video_id = path[1]
+        if YOUTUBE_ID.match(video_id):
+            return f"youtube:{video_id}"
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if not TRACKING_PARAMS.match(k))
+    return urlunparse((parsed.scheme.lower(), host, parsed.path or "/", parsed.params, urlencode(query), ""))
+
+
 def adjust_formats(formats):
     # high: best quality 1080P, 2K, 4K, 8K
     # medium: 720P
@@ -6,47 +6,42 @@ FastAPI web application for video downloading
 """
 
 import asyncio
+import hashlib
 import json
 import logging
 import os
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, HttpUrl
 
+from config import WEB_BATCH_PARALLEL, WEB_BATCH_SIZE, WEB_LONG_POLL_MAX
+
+from engine.credentials import credentials
+from engine.extraction import extraction
+from engine.pool import pool
+from engine.store import media_store
+from engine.tuner import tuner
+from engine.ytcache import CountingCache
+from utils import parse_time_range
+
+from .batch import aggregate, zip_stream
 from .downloader import WebDownloader, DownloadTask
+from .files import content_disposition, file_response
+from .infocache import info_cache
+from .progress import ProgressThrottle, bus
+from .scheduler import QueueFull, scheduler
+from .streaming import ClosingStreamingResponse, ProgressiveStream
+from .tasks import ACTIVE_TTL, FINISHED, tasks
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# WebSocket connections manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-
-    async def connect(self, task_id: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[task_id] = websocket
-
-    def disconnect(self, task_id: str):
-        self.active_connections.pop(task_id, None)
-
-    async def send_progress(self, task_id: str, data: dict):
-        if ws := self.active_connections.get(task_id):
-            try:
-                await ws.send_json(data)
-            except Exception:
-                self.disconnect(task_id)
-
-
-manager = ConnectionManager()
-
-
 # Cleanup task for old downloads
 async def cleanup_old_files():
     """Periodically clean up old download files"""
@@ -69,9 +64,11 @@ async def cleanup_old_files():
 async def lifespan(app: FastAPI):
     # Startup
     cleanup_task = asyncio.create_task(cleanup_old_files())
+    bus.start(asyncio.get_running_loop())
     yield
     # Shutdown
     cleanup_task.cancel()
+    bus.stop()
 
 
 # Create FastAPI app
@@ -100,6 +97,7 @@ class DownloadRequest(BaseModel):
     url: str
     format_id: Optional[str] = None
     height: Optional[int] = None
+    clip: Optional[str] = None  # e.g. "1:30-2:00"
 
 
 class DownloadResponse(BaseModel):
@@ -107,6 +105,19 @@ class DownloadResponse(BaseModel):
     status: str
 
 
+class BatchRequest(BaseModel):
+    urls: list[str]
+    format_id: Optional[str] = None
+    height: Optional[int] = None
+    clip: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    task_ids: list[str]
+    status: str
+
+
 class TaskStatusResponse(BaseModel):
     task_id: str
     status: str
@@ -115,6 +126,13 @@ class TaskStatusResponse(BaseModel):
     eta: str
     filename: str
     error: str
+    queue_position: int = 0
+    version: int = 0
+
+
+class TaskStatusListResponse(BaseModel):
+    tasks: list[TaskStatusResponse]
+    missing: list[str]
 
 
 # API Routes
@@ -122,8 +140,10 @@ class TaskStatusResponse(BaseModel):
 async def get_video_info(request: VideoInfoRequest):
     """Get video information and available formats"""
     try:
-        downloader = WebDownloader(request.url)
-        info = await asyncio.to_thread(downloader.get_video_info)
+        # cached by video, concurrent lookups of the same video share one extraction
+        info = await info_cache.get(
+            request.url, lambda: scheduler.run_info(WebDownloader(request.url).get_video_info)
+        )
         return VideoInfoResponse(**info)
     except Exception as e:
         logger.error(f"Error getting video info: {e}")
@@ -133,90 +153,296 @@ async def get_video_info(request: VideoInfoRequest):
 @app.post("/api/download", response_model=DownloadResponse)
 async def start_download(request: DownloadRequest):
     """Start a download task"""
-    task = WebDownloader.create_task(request.url)
-    task.status = "started"
+    return await queue_download(request)
+
+
+async def queue_download(request: DownloadRequest, info: Optional[dict] = None) -> DownloadResponse:
+    """Create, admit and start a download task, info is reused when the video was already extracted"""
+    try:
+        clip = parse_time_range(request.clip) if request.clip else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    task = await WebDownloader.create_task(request.url)
+    try:
+        scheduler.admit(task.task_id)
+    except QueueFull as e:
+        WebDownloader.remove_task(task.task_id)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    tasks.update(task, status="started")
 
     # Start download in background
     asyncio.create_task(
-        run_download(task.task_id, request.url, request.format_id, request.height)
+        run_download(task.task_id, request.url, request.format_id, request.height, clip, info=info)
     )
 
     return DownloadResponse(task_id=task.task_id, status="started")
 
 
-async def run_download(task_id: str, url: str, format_id: Optional[str], height: Optional[int]):
-    """Run download in background and update progress via WebSocket"""
-    task = WebDownloader.get_task(task_id)
+async def run_download(
+    task_id: str,
+    url: str,
+    format_id: Optional[str],
+    height: Optional[int],
+    clip: Optional[tuple] = None,
+    on_change: Optional[Callable] = None,
+    info: Optional[dict] = None,
+):
+    """Run download in background and update progress via WebSocket, on_change is called after every update"""
+    task = await WebDownloader.get_task(task_id)
     if not task:
+        # expired before it started, its place in the queue goes back
+        scheduler.cancel(task_id)
         return
 
     downloader = WebDownloader(url)
-    loop = asyncio.get_event_loop()
-    progress_queue = asyncio.Queue()
-
-    def progress_callback(data: dict):
-        task.status = data.get("status", "downloading")
-        task.progress = data.get("progress", 0)
-        task.speed = data.get("speed", "")
-        task.eta = data.get("eta", "")
-
-        # Thread-safe: put data in queue
-        loop.call_soon_threadsafe(progress_queue.put_nowait, data)
-
-    downloader.set_progress_callback(progress_callback)
-
-    # Progress sender task
-    async def send_progress_updates():
-        while True:
-            try:
-                data = await asyncio.wait_for(progress_queue.get(), timeout=0.5)
-                await manager.send_progress(task_id, data)
-            except asyncio.TimeoutError:
-                continue
-            except asyncio.CancelledError:
-                break
-
-    progress_task = asyncio.create_task(send_progress_updates())
+    loop = asyncio.get_running_loop()
+
+    def on_progress(data: dict):
+        tasks.update(
+            task,
+            status=data.get("status", "downloading"),
+            progress=data.get("progress", 0),
+            speed=data.get("speed", ""),
+            eta=data.get("eta", ""),
+        )
+        bus.publish(task_id, data)
+        if on_change:
+            on_change()
+
+    # yt-dlp hooks run in the download thread, only the latest state reaches the loop
+    throttle = ProgressThrottle(loop, on_progress, bus.interval)
+    downloader.set_progress_callback(throttle)
+
+    def on_queue(position: int):
+        if not position:
+            tasks.update(task, status="downloading", position=0)
+        else:
+            tasks.update(task, status="queued", position=position)
+            bus.publish(task_id, {"status": "queued", "progress": 0, "position": position})
+        if on_change:
+            on_change()
 
     try:
-        task.status = "downloading"
-        filepath = await asyncio.to_thread(downloader.download, format_id, height)
+        try:
+            filepath = await scheduler.run(
+                task_id, downloader.download, format_id, height, clip, info, on_queue=on_queue
+            )
+        finally:
+            throttle.close()
 
-        task.status = "completed"
-        task.progress = 100
-        task.filepath = filepath
-        task.filename = Path(filepath).name
+        tasks.update(task, status="completed", progress=100, filepath=filepath, filename=Path(filepath).name)
 
-        await manager.send_progress(task_id, {
+        bus.publish(task_id, {
             "status": "completed",
             "progress": 100,
             "filename": task.filename,
         })
 
     except Exception as e:
-        task.status = "error"
-        task.error = str(e)
+        tasks.update(task, status="error", error=str(e))
         logger.error(f"Download error for task {task_id}: {e}")
 
-        await manager.send_progress(task_id, {
+        bus.publish(task_id, {
             "status": "error",
             "error": str(e),
         })
     finally:
-        progress_task.cancel()
+        # only needed when it never got to the scheduler
+        scheduler.cancel(task_id)
+
+    if on_change:
+        on_change()
+
+
+@app.post("/api/batch", response_model=BatchResponse)
+async def start_batch(request: BatchRequest):
+    """Download several urls with the same options, progress of all of them on /ws or /sse of the batch id"""
+    urls = list(dict.fromkeys(url.strip() for url in request.urls if url.strip()))
+    if not urls:
+        raise HTTPException(status_code=400, detail="No urls given")
+    if len(urls) > WEB_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {WEB_BATCH_SIZE} urls per batch")
+    try:
+        clip = parse_time_range(request.clip) if request.clip else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    members = [await WebDownloader.create_task(url) for url in urls]
+    try:
+        # the rest are admitted as the batch gets to them, a full queue rejects the batch now
+        scheduler.admit(members[0].task_id)
+    except QueueFull as e:
+        for task in members:
+            WebDownloader.remove_task(task.task_id)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    # the batch is a task too: /api/download, /ws and /sse report its aggregate state
+    batch = await WebDownloader.create_task("batch")
+    task_ids = [task.task_id for task in members]
+    await tasks.save_batch(batch.task_id, task_ids, ACTIVE_TTL)
+    tasks.update(batch, status="started", title=f"{len(urls)} videos")
+
+    asyncio.create_task(run_batch(batch.task_id, members, request.format_id, request.height, clip))
+    return BatchResponse(batch_id=batch.task_id, task_ids=task_ids, status="started")
+
+
+async def run_batch(
+    batch_id: str, members: list[DownloadTask], format_id: Optional[str], height: Optional[int], clip: Optional[tuple]
+):
+    """Run the member downloads, WEB_BATCH_PARALLEL at a time, and publish the aggregate state"""
+    batch = await WebDownloader.get_task(batch_id)
+    gate = asyncio.Semaphore(WEB_BATCH_PARALLEL)
+
+    def on_change():
+        state = aggregate([tasks.local(task.task_id) or task for task in members])
+        if (batch.status, batch.progress) != (state["status"], state["progress"]):
+            tasks.update(batch, status=state["status"], progress=state["progress"])
+        bus.publish(batch_id, state)
+
+    async def run(task: DownloadTask, admitted: bool):
         try:
-            await progress_task
-        except asyncio.CancelledError:
-            pass
+            async with gate:
+                while not admitted:
+                    try:
+                        scheduler.admit(task.task_id)
+                        admitted = True
+                    except QueueFull as e:
+                        # single downloads keep priority, the batch waits instead of failing
+                        await asyncio.sleep(e.retry_after)
+                await run_download(task.task_id, task.url, format_id, height, clip, on_change=on_change)
+        finally:
+            scheduler.cancel(task.task_id)
+
+    await asyncio.gather(*(run(task, i == 0) for i, task in enumerate(members)))
+    on_change()
+    # gone together with the member tasks
+    await tasks.save_batch(batch_id, [task.task_id for task in members], tasks.ttl)
+
+
+async def get_batch_members(batch_id: str) -> list[DownloadTask]:
+    task_ids = await tasks.get_batch(batch_id)
+    members = list((await tasks.get_many(task_ids)).values())
+    if not members or not all(members):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return members
+
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """Aggregate state of a batch and of each of its downloads"""
+    return {"batch_id": batch_id, **aggregate(await get_batch_members(batch_id))}
+
+
+@app.get("/api/batch/{batch_id}/zip")
+async def download_batch(batch_id: str):
+    """The completed files of a finished batch as one ZIP, streamed while it's written"""
+    members = await get_batch_members(batch_id)
+    if any(task.status not in FINISHED for task in members):
+        raise HTTPException(status_code=400, detail="Batch not finished")
+    files = [
+        (task.filepath, task.filename)
+        for task in members
+        if task.status == "completed" and task.filepath and Path(task.filepath).exists()
+    ]
+    if not files:
+        raise HTTPException(status_code=404, detail="No files to download")
+    return StreamingResponse(
+        zip_stream(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(f"batch-{batch_id}.zip")},
+    )
 
 
-@app.get("/api/download/{task_id}", response_model=TaskStatusResponse)
-async def get_download_status(task_id: str):
-    """Get download task status"""
-    task = WebDownloader.get_task(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+@app.get("/api/stream")
+async def stream_download(url: str, height: Optional[int] = None, format_id: Optional[str] = None):
+    """
+    Pipe a single-file format to the client while it downloads, the file is kept for /api/file.
+    Formats that need merging start a normal download task instead.
+    """
+    task = await WebDownloader.create_task(url)
+    try:
+        scheduler.admit(task.task_id)
+    except QueueFull as e:
+        WebDownloader.remove_task(task.task_id)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    # nothing upstream is opened while the request waits for its slot
+    try:
+        started = await scheduler.acquire(task.task_id)
+    except BaseException:
+        WebDownloader.remove_task(task.task_id)
+        raise
+
+    stream = ProgressiveStream(url, height, format_id)
+    done = False
+
+    def finish(error: Optional[str] = None):
+        # runs once: after the last chunk, on a failure, or when the response closes first
+        nonlocal done
+        if done:
+            return
+        done = True
+        scheduler.release(started)
+        if error is None:
+            stream.close()
+            tasks.update(task, status="completed", progress=100, filepath=stream.filepath, filename=stream.filename)
+            bus.publish(task.task_id, {"status": "completed", "progress": 100, "filename": stream.filename})
+        else:
+            # the partial file and the temp directory are dropped
+            stream.close(abort=True)
+            tasks.update(task, status="error", error=error)
+            bus.publish(task.task_id, {"status": "error", "error": error})
+
+    def discard(*_):
+        nonlocal done
+        done = True
+        scheduler.release(started)
+        WebDownloader.remove_task(task.task_id)
+        stream.close(abort=True)
+
+    loop = asyncio.get_running_loop()
+    opening = loop.run_in_executor(scheduler.executor, stream.open)
+    try:
+        progressive = await asyncio.shield(opening)
+    except asyncio.CancelledError:
+        # the worker thread still holds the stream, it's cleaned up once open returns
+        opening.add_done_callback(discard)
+        raise
+    except Exception as e:
+        discard()
+        logger.error(f"Error opening stream of {url}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    if not progressive:
+        # the slot goes back first, the normal download is queued like any other
+        discard()
+        return await queue_download(DownloadRequest(url=url, format_id=format_id, height=height), info=stream.info)
+    tasks.update(task, status="downloading", filesize=stream.size)
 
+    async def body():
+        try:
+            while chunk := await loop.run_in_executor(scheduler.executor, stream.read):
+                yield chunk
+                progress = stream.position * 100 // stream.size if stream.size else 0
+                if progress != task.progress:
+                    tasks.update(task, progress=progress)
+                    bus.publish(task.task_id, {"status": "downloading", "progress": progress})
+        except BaseException as e:
+            # the client went away or the source failed
+            finish(str(e) if isinstance(e, Exception) else "client disconnected")
+            raise
+        else:
+            finish()
+
+    def on_close():
+        finish("client disconnected")
+
+    headers = {"Content-Disposition": content_disposition(stream.filename), "X-Task-Id": task.task_id}
+    if stream.size:
+        headers["Content-Length"] = str(stream.size)
+    return ClosingStreamingResponse(body(), on_close, media_type=stream.media_type, headers=headers)
+
+
+def status_response(task: DownloadTask) -> TaskStatusResponse:
     return TaskStatusResponse(
         task_id=task.task_id,
         status=task.status,
@@ -225,13 +451,92 @@ async def get_download_status(task_id: str):
         eta=task.eta,
         filename=task.filename,
         error=task.error,
+        queue_position=task.position if task.status == "queued" else 0,
+        version=task.version,
     )
 
 
-@app.get("/api/file/{task_id}")
-async def download_file(task_id: str):
-    """Download the completed file"""
-    task = WebDownloader.get_task(task_id)
+def status_etag(versions: dict[str, int]) -> str:
+    digest = hashlib.sha1(",".join(f"{task_id}:{v}" for task_id, v in versions.items()).encode()).hexdigest()
+    return f'"{digest[:16]}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    return etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+
+
+@app.get("/api/download/{task_id}", response_model=TaskStatusResponse)
+async def get_download_status(task_id: str, request: Request, response: Response, wait: float = 0):
+    """
+    Get download task status. 304 when If-None-Match has the current ETag,
+    with ?wait=seconds such a request is held until the task changes.
+    """
+    task = await WebDownloader.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    versions = {task_id: task.version}
+    if wait > 0 and not_modified(request, status_etag(versions)):
+        if await tasks.wait(versions, min(wait, WEB_LONG_POLL_MAX)):
+            task = await WebDownloader.get_task(task_id)
+            if not task:
+                raise HTTPException(status_code=404, detail="Task not found")
+
+    headers = {"ETag": status_etag({task_id: task.version}), "Cache-Control": "no-cache"}
+    if not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return status_response(task)
+
+
+@app.get("/api/downloads", response_model=TaskStatusListResponse)
+async def get_download_statuses(ids: str, request: Request, response: Response, wait: float = 0):
+    """
+    Status of several tasks in one call, ids comma separated. ETag and ?wait= work as for a single task,
+    the long poll returns as soon as any of them changes.
+    """
+    task_ids = list(dict.fromkeys(task_id.strip() for task_id in ids.split(",") if task_id.strip()))
+    if not task_ids or len(task_ids) > WEB_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Give 1 to {WEB_BATCH_SIZE} task ids")
+
+    current = await tasks.get_many(task_ids)
+    versions = {task_id: task.version for task_id, task in current.items() if task}
+    if wait > 0 and versions and not_modified(request, status_etag(versions)):
+        if await tasks.wait(versions, min(wait, WEB_LONG_POLL_MAX)):
+            current = await tasks.get_many(task_ids)
+
+    found = [task for task in current.values() if task]
+    headers = {"ETag": status_etag({task.task_id: task.version for task in found}), "Cache-Control": "no-cache"}
+    if found and not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return TaskStatusListResponse(
+        tasks=[status_response(task) for task in found],
+        missing=[task_id for task_id, task in current.items() if not task],
+    )
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Runtime metrics of the download engine"""
+    return {
+        "fragments": tuner.snapshot(),
+        "ytdl_pool": pool.snapshot(),
+        "credentials": credentials.snapshot(),
+        "extraction": extraction.snapshot(),
+        "ytdlp_cache": CountingCache.snapshot(),
+        "web_tasks": tasks.snapshot(),
+        "progress": bus.snapshot(),
+        "scheduler": scheduler.snapshot(),
+        "info_cache": info_cache.snapshot(),
+        "media_store": media_store.snapshot(),
+    }
+
+
+@app.api_route("/api/file/{task_id}", methods=["GET", "HEAD"])
+async def download_file(task_id: str, request: Request):
+    """Download the completed file, resumable with Range requests"""
+    task = await WebDownloader.get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -241,18 +546,23 @@ async def download_file(task_id: str):
     if not task.filepath or not Path(task.filepath).exists():
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(
-        path=task.filepath,
-        filename=task.filename,
-        media_type="application/octet-stream",
-    )
+    return file_response(request, task.filepath, task.filename)
 
 
 # WebSocket for real-time progress
 @app.websocket("/ws/{task_id}")
 async def websocket_progress(websocket: WebSocket, task_id: str):
-    """WebSocket endpoint for real-time download progress"""
-    await manager.connect(task_id, websocket)
+    """WebSocket endpoint for real-time download progress, any number of clients per task"""
+    await websocket.accept()
+
+    async def forward():
+        try:
+            async for data in bus.subscribe(task_id):
+                await websocket.send_json(data)
+        except Exception:
+            pass  # client went away, the receive loop notices
+
+    sender = asyncio.create_task(forward())
     try:
         while True:
             # Keep connection alive, wait for messages
@@ -261,7 +571,28 @@ async def websocket_progress(websocket: WebSocket, task_id: str):
             if data == "ping":
                 await websocket.send_text("pong")
     except WebSocketDisconnect:
-        manager.disconnect(task_id)
+        pass
+    finally:
+        sender.cancel()
+
+
+# Server-sent events for clients that can't hold a WebSocket
+@app.get("/sse/{task_id}")
+async def sse_progress(task_id: str):
+    """Same messages as /ws/{task_id}, the stream ends when the task finishes"""
+    if not await WebDownloader.get_task(task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    async def events():
+        async for data in bus.subscribe(task_id, heartbeat=15):
+            # a comment line keeps proxies from closing an idle stream
+            yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n" if data is not None else ": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # Serve static files and index.html
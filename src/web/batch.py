@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Batch downloads: aggregate progress of the member tasks and one ZIP of their files, written while it's sent
+"""
+
+import os
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterator
+
+from .tasks import FINISHED, DownloadTask
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def aggregate(members: list[DownloadTask]) -> dict:
+    """Progress message of a batch, in the same shape as a single task's plus the member states"""
+    done = [task for task in members if task.status in FINISHED]
+    completed = sum(task.status == "completed" for task in done)
+    if len(done) == len(members):
+        status = "completed" if completed else "error"
+    elif any(task.status in ("downloading", "processing") for task in members):
+        status = "downloading"
+    else:
+        status = "queued"
+    progress = sum(100 if task.status in FINISHED else task.progress for task in members)
+    return {
+        "status": status,
+        "progress": progress // len(members),
+        "total": len(members),
+        "completed": completed,
+        "failed": len(done) - completed,
+        "items": [
+            {
+                "task_id": task.task_id,
+                "url": task.url,
+                "status": task.status,
+                "progress": task.progress,
+                "filename": task.filename,
+                "error": task.error,
+            }
+            for task in members
+        ],
+    }
+
+
+class _Buffer:
+    """Write-only file for ZipFile, drained by the generator after every write"""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _names(files: list[tuple[str, str]]) -> Iterator[tuple[str, str]]:
+    # two videos with the same title must not overwrite each other when extracted
+    seen = set()
+    for path, filename in files:
+        name, stem, suffix, n = filename, Path(filename).stem, Path(filename).suffix, 1
+        while name in seen:
+            n += 1
+            name = f"{stem} ({n}){suffix}"
+        seen.add(name)
+        yield path, name
+
+
+def zip_stream(files: list[tuple[str, str]]) -> Iterator[bytes]:
+    """
+    (path, name) pairs as a ZIP of stored entries. Videos don't compress, so nothing is deflated and
+    nothing is built on disk: every piece is sent as soon as ZipFile writes it, data descriptors
+    carry the CRCs and zip64 records kick in for big files or archives.
+    """
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for path, name in _names(files):
+            st = os.stat(path)
+            info = zipfile.ZipInfo(name, time.localtime(st.st_mtime)[:6])
+            info.file_size = st.st_size
+            zip64 = st.st_size >= zipfile.ZIP64_LIMIT
+            with open(path, "rb") as source, archive.open(info, "w", force_zip64=zip64) as entry:
+                while chunk := source.read(CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    # central directory
+    yield buffer.drain()
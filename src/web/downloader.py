@@ -6,26 +6,22 @@ Web video downloader - standalone downloader for web interface
 """
 
 import logging
-import os
 import re
 import tempfile
-import uuid
 from pathlib import Path
 from typing import Callable
 
-import yt_dlp
+from yt_dlp.utils import download_range_func
 
+from engine.credentials import credentials
+from engine.extraction import extraction, with_clients
+from engine.generic import select_formats
+from engine.pool import pool
+from engine.postprocess import is_thumb
+from engine.store import media_store, store_key
+from engine.tuner import tuner
 
-def is_youtube(url: str) -> bool:
-    """Check if URL is a YouTube URL"""
-    from urllib.parse import urlparse
-    try:
-        if not url or not isinstance(url, str):
-            return False
-        parsed = urlparse(url)
-        return parsed.netloc.lower() in {'youtube.com', 'www.youtube.com', 'youtu.be'}
-    except Exception:
-        return False
+from .tasks import DownloadTask, tasks
 
 
 def sizeof_fmt(num: int, suffix="B") -> str:
@@ -37,29 +33,9 @@ def sizeof_fmt(num: int, suffix="B") -> str:
     return "%.1f%s%s" % (num, "Yi", suffix)
 
 
-class DownloadTask:
-    """Represents a download task with its state"""
-
-    def __init__(self, task_id: str, url: str):
-        self.task_id = task_id
-        self.url = url
-        self.status = "pending"  # pending, downloading, completed, error
-        self.progress = 0
-        self.speed = ""
-        self.eta = ""
-        self.filename = ""
-        self.filepath = ""
-        self.error = ""
-        self.title = ""
-        self.filesize = 0
-
-
 class WebDownloader:
     """Standalone video downloader for web interface"""
 
-    # Store active tasks
-    tasks: dict[str, DownloadTask] = {}
-
     # Max file size (2GB)
     MAX_FILE_SIZE = 2000 * 1024 * 1024
 
@@ -67,6 +43,8 @@ class WebDownloader:
         self.url = url
         self._tempdir = tempfile.mkdtemp(prefix="ytdl-web-")
         self._progress_callback: Callable | None = None
+        self._lease = None
+        self._credential = None
 
     def set_progress_callback(self, callback: Callable):
         """Set callback for progress updates"""
@@ -77,34 +55,38 @@ class WebDownloader:
         opts = {
             "quiet": True,
             "no_warnings": True,
+            "restrictfilenames": False,
+            "buffersize": 4194304,
+            "retries": 6,
+            "fragment_retries": 6,
+            "skip_unavailable_fragments": True,
         }
 
-        if is_youtube(self.url):
-            # Browser cookies
-            if browsers := os.getenv("BROWSERS"):
-                opts["cookiesfrombrowser"] = browsers.split(",")
-
-            # Cookie file
-            cookie_file = "youtube-cookies.txt"
-            if os.path.isfile(cookie_file) and os.path.getsize(cookie_file) > 100:
-                opts["cookiefile"] = cookie_file
-
-            # PO Token
-            if potoken := os.getenv("POTOKEN"):
-                opts["extractor_args"] = {
-                    "youtube": ["player-client=web,default", f"po_token=web+{potoken}"]
-                }
+        # Cookies and PO token for YouTube, shared with the bot
+        self._credential = credentials.acquire(self.url)
+        if self._credential:
+            opts.update(self._credential.options())
 
         return opts
 
+    def _checkout(self, **job):
+        """Check out a pooled YoutubeDL with the current credential"""
+        opts = self._get_ydl_opts()
+        if self._credential and (clients := extraction.client_order()):
+            # Player client that won the recent extraction races
+            opts = with_clients(opts, clients[:1])
+        return pool.checkout(opts, self._credential.jar if self._credential else None, **job)
+
     def get_video_info(self) -> dict:
         """Get video information and available formats"""
-        ydl_opts = self._get_ydl_opts()
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(self.url, download=False)
+        opts = self._get_ydl_opts()
+        try:
+            info = extraction.extract(self.url, opts, self._credential)
+        except Exception as e:
+            credentials.report(self._credential, e)
+            raise
 
-        duration = info.get("duration", 0)
+        duration = int(info.get("duration") or 0)
 
         # Filter and organize formats
         formats = []
@@ -140,15 +122,17 @@ class WebDownloader:
                 unique_formats.append(f)
 
         return {
-            "title": info.get("title", "Unknown"),
+            "title": info.get("title") or "Unknown",
             "duration": duration,
-            "thumbnail": info.get("thumbnail", ""),
-            "uploader": info.get("uploader", ""),
+            "thumbnail": info.get("thumbnail") or "",
+            "uploader": info.get("uploader") or "",
             "formats": unique_formats[:6],  # Max 6 options
         }
 
     def _progress_hook(self, d: dict):
         """Handle download progress"""
+        if self._lease:
+            self._lease.observe(d)
         if d["status"] == "downloading":
             downloaded = d.get("downloaded_bytes", 0)
             total = d.get("total_bytes") or d.get("total_bytes_estimate", 0)
@@ -168,6 +152,7 @@ class WebDownloader:
                     "eta": eta,
                     "downloaded": sizeof_fmt(downloaded),
                     "total": sizeof_fmt(total) if total else "Unknown",
+                    "fragments": self._lease.concurrency if self._lease else 0,
                 })
 
         elif d["status"] == "finished":
@@ -183,13 +168,17 @@ class WebDownloader:
         """Remove ANSI color codes from string"""
         return re.sub(r"\u001b|\[0;94m|\u001b\[0m|\[0;32m|\[0m|\[0;33m", "", str(text))
 
-    def download(self, format_id: str = None, height: int = None) -> str:
+    def download(
+        self, format_id: str = None, height: int = None, clip: tuple[float, float] = None, info: dict = None
+    ) -> str:
         """
         Download video and return filepath
 
         Args:
             format_id: Specific format ID to download, or None for best quality
             height: Video height limit (e.g., 720 for 720p)
+            clip: (start, end) in seconds, only this part is downloaded
+            info: Info dict already extracted for this url, skips the extraction
 
         Returns:
             Path to downloaded file
@@ -199,19 +188,14 @@ class WebDownloader:
 
         output = Path(self._tempdir, "%(title).70s.%(ext)s").as_posix()
 
-        ydl_opts = self._get_ydl_opts()
-        ydl_opts.update({
+        job_opts = {
             "progress_hooks": [self._progress_hook],
             "outtmpl": output,
-            "restrictfilenames": False,
-            "quiet": True,
-            "concurrent_fragments": 16,
-            "buffersize": 4194304,
-            "retries": 6,
-            "fragment_retries": 6,
-            "skip_unavailable_fragments": True,
-            "embed_metadata": True,
-        })
+        }
+        if clip:
+            # Only the fragments covering the range, cut at keyframes with stream copy
+            job_opts["download_ranges"] = download_range_func(None, [clip])
+            job_opts["force_keyframes_at_cuts"] = False
 
         # Set format - 使用 <=? 可选过滤器
         # 参考: https://github.com/yt-dlp/yt-dlp#format-selection
@@ -238,18 +222,41 @@ class WebDownloader:
 
         # Try each format until one succeeds
         last_error = None
-        for fmt in format_list:
-            ydl_opts["format"] = fmt
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([self.url])
-                files = list(Path(self._tempdir).glob("*"))
-                if files:
-                    return str(files[0])
-            except Exception as e:
-                logger.warning(f"Format {fmt} failed: {e}, trying next...")
-                last_error = e
-                continue
+        self._lease = tuner.acquire(f"web:{Path(self._tempdir).name}", job_opts)
+        try:
+            with self._checkout(**job_opts) as ydl:
+                self._lease.bind(ydl.params)
+                # Extract once, each format is selected locally and looked up in the media store
+                info = info or ydl.extract_info(self.url, download=False)
+                ie_key = info.get("extractor_key") or "Generic"
+                for fmt in format_list:
+                    if not (selected := select_formats(ydl, info, fmt)):
+                        logger.info(f"Format {fmt} is not available, trying next...")
+                        continue
+                    key = store_key(ie_key, info["id"], selected[0]["format_id"], clip)
+                    if stored := media_store.fetch(key, self._tempdir):
+                        return str(next(p for p in stored if not is_thumb(p)))
+                    ydl.params["format"] = fmt
+                    ydl.format_selector = ydl.build_format_selector(fmt)
+                    try:
+                        ydl.process_ie_result(dict(info), download=True)
+                        files = list(Path(self._tempdir).glob("*"))
+                        if files:
+                            media_store.publish(key, files)
+                            return str(files[0])
+                    except Exception as e:
+                        logger.warning(f"Format {fmt} failed: {e}, trying next...")
+                        last_error = e
+                        credentials.report(self._credential, e)
+                        # Partial files of this format must not be published with the next one
+                        for leftover in Path(self._tempdir).glob("*"):
+                            leftover.unlink(missing_ok=True)
+                        continue
+        except Exception as e:
+            credentials.report(self._credential, e)
+            raise
+        finally:
+            self._lease.release()
 
         if last_error:
             raise last_error
@@ -264,19 +271,16 @@ class WebDownloader:
             pass
 
     @classmethod
-    def create_task(cls, url: str) -> DownloadTask:
+    async def create_task(cls, url: str) -> DownloadTask:
         """Create a new download task"""
-        task_id = uuid.uuid4().hex[:12]
-        task = DownloadTask(task_id, url)
-        cls.tasks[task_id] = task
-        return task
+        return await tasks.create(url)
 
     @classmethod
-    def get_task(cls, task_id: str) -> DownloadTask | None:
-        """Get task by ID"""
-        return cls.tasks.get(task_id)
+    async def get_task(cls, task_id: str) -> DownloadTask | None:
+        """Get task by ID, from any worker"""
+        return await tasks.get(task_id)
 
     @classmethod
     def remove_task(cls, task_id: str):
-        """Remove task from memory"""
-        cls.tasks.pop(task_id, None)
+        """Remove task from memory and redis"""
+        tasks.remove(task_id)
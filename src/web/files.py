@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+File serving for finished web downloads: ranges, conditional requests, zero-copy or offloaded to nginx
+"""
+
+import os
+import re
+import stat
+import tempfile
+from email.utils import formatdate
+from pathlib import Path
+from urllib.parse import quote
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from config import FILE_OFFLOAD, FILE_OFFLOAD_PREFIX
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def content_disposition(filename: str) -> str:
+    # rfc 6266, the ascii fallback keeps old clients working with unicode titles
+    fallback = filename.encode("ascii", "replace").decode().replace('"', "")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    (start, end) of a single `bytes=` range, end exclusive. None means serve the whole file,
+    ValueError means the range can't be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    match = re.fullmatch(r"\s*(\d*)-(\d*)\s*", spec)
+    if unit.strip() != "bytes" or not match or not any(match.groups()):
+        # several ranges or a malformed header, multipart/byteranges isn't worth it for video downloads
+        return None
+    first, last = match.groups()
+    if not first:
+        if not int(last):
+            raise ValueError(header)
+        return max(0, size - int(last)), size
+    start, end = int(first), int(last) + 1 if last else size
+    if start >= size or end <= start:
+        raise ValueError(header)
+    return start, min(end, size)
+
+
+class RangeFileResponse(Response):
+    """
+    Whole file or one byte range, sent with the ASGI zerocopysend extension when the server has it,
+    otherwise read in chunks on a worker thread.
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict):
+        super().__init__(status_code=status_code, headers=headers, media_type="application/octet-stream")
+        self.path = path
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": f.fileno(),
+                        "offset": self.start,
+                        "count": self.end - self.start,
+                    }
+                )
+                return
+            position = self.start
+            while position < self.end:
+                size = min(CHUNK_SIZE, self.end - position)
+                chunk = await anyio.to_thread.run_sync(os.pread, f.fileno(), size, position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": position < self.end})
+        if position < self.end or self.start == self.end:
+            await send({"type": "http.response.body", "body": b""})
+
+
+def _offload(path: str, headers: dict) -> Response | None:
+    if FILE_OFFLOAD == "sendfile":
+        # apache mod_xsendfile, which unescapes the path by default
+        return Response(headers={**headers, "X-Sendfile": quote(path)}, media_type="application/octet-stream")
+    if FILE_OFFLOAD == "accel":
+        # nginx: `location <prefix>/ { internal; alias <temp dir>/; }`
+        try:
+            relative = Path(path).resolve().relative_to(Path(tempfile.gettempdir()).resolve())
+        except ValueError:
+            return None
+        location = f"{FILE_OFFLOAD_PREFIX.rstrip('/')}/{quote(relative.as_posix())}"
+        return Response(headers={**headers, "X-Accel-Redirect": location}, media_type="application/octet-stream")
+    return None
+
+
+def file_response(request: Request, path: str, filename: str) -> Response:
+    """Serve path as an attachment, honouring Range, If-Range and If-None-Match"""
+    st = os.stat(path)
+    etag = _etag(st)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(filename),
+    }
+    if (offloaded := _offload(path, headers)) is not None:
+        # the front server does ranges and conditional requests itself
+        return offloaded
+
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    size = st.st_size
+    span = None
+    if_range = request.headers.get("if-range")
+    if (header := request.headers.get("range")) and stat.S_ISREG(st.st_mode):
+        # a stale If-Range means the client's partial copy is of another file, send everything
+        if not if_range or if_range in (etag, headers["Last-Modified"]):
+            try:
+                span = parse_range(header, size)
+            except ValueError:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    start, end = span or (0, size)
+    headers["Content-Length"] = str(end - start)
+    if span:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return RangeFileResponse(path, start, end, 206 if span else 200, headers)
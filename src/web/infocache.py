@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Cache for /api/info answers, shared by all workers through redis
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from config import INFO_CACHE_STALE, INFO_CACHE_TTL
+from database import Redis
+from utils import canonical_id
+
+from .tasks import redis_call
+
+
+class InfoCache:
+    """
+    Answers are keyed by canonical video identity. A fresh one (younger than `ttl`) is returned as is,
+    a stale one (up to `stale` seconds more) is returned too while a refresh runs in the background.
+    Concurrent lookups of the same video in this process share one extraction.
+    """
+
+    def __init__(self, ttl: int, stale: int):
+        self.ttl = ttl
+        self.stale = stale
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._redis: Redis | None = None
+        self.stats = {"hit": 0, "stale": 0, "miss": 0, "coalesced": 0, "error": 0}
+
+    @property
+    def redis(self) -> Redis:
+        self._redis = self._redis or Redis()
+        return self._redis
+
+    async def get(self, url: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        key = canonical_id(url)
+        if cached := await redis_call(self.redis.get_info, key):
+            age = time.time() - cached["ts"]
+            if age < self.ttl:
+                self.stats["hit"] += 1
+                return cached["info"]
+            self.stats["stale"] += 1
+            refresh = self._load(key, fetch)
+            # the refresh outlives this request, its errors are only logged
+            refresh.add_done_callback(lambda f: f.cancelled() or f.exception())
+            return cached["info"]
+        # waiting for a lookup already running counts as a hit, it costs no extraction
+        self.stats["coalesced" if key in self._inflight else "miss"] += 1
+        return await asyncio.shield(self._load(key, fetch))
+
+    def _load(self, key: str, fetch: Callable[[], Awaitable[dict]]) -> asyncio.Future:
+        if future := self._inflight.get(key):
+            return future
+        future = asyncio.ensure_future(self._fetch(key, fetch))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return future
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        try:
+            info = await fetch()
+        except Exception as e:
+            # failures aren't cached, the next lookup tries again
+            self.stats["error"] += 1
+            logging.warning("Info lookup of %s failed: %s", key, e)
+            raise
+        await redis_call(self.redis.set_info, key, {"ts": time.time(), "info": info}, self.ttl + self.stale)
+        return info
+
+    def snapshot(self) -> dict:
+        served = self.stats["hit"] + self.stats["stale"] + self.stats["coalesced"]
+        lookups = served + self.stats["miss"]
+        return {
+            **self.stats,
+            "inflight": len(self._inflight),
+            "hit_ratio": round(served / lookups, 3) if lookups else 0,
+        }
+
+
+info_cache = InfoCache(INFO_CACHE_TTL, INFO_CACHE_STALE)
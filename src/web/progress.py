@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Progress bus: fans download progress out to every WebSocket/SSE subscriber, in any worker process
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+
+from config import PROGRESS_RATE, WEB_TASK_TTL
+from database import Redis
+
+from .tasks import FINISHED, RedisWriter, redis_call
+
+
+class ProgressBus:
+    """
+    Messages of a task are coalesced to at most `rate` per second, the final one is never delayed.
+    Subscribers in this process get them directly, other processes through redis pub/sub.
+    The last message of each task is kept in redis and replayed to new subscribers.
+    Publishing to redis is written behind, the loop doesn't wait for it.
+    """
+
+    def __init__(self, rate: float, ttl: int):
+        self.interval = 1 / rate if rate else 0
+        self.ttl = ttl
+        # messages published by this process are skipped when they come back from redis
+        self.origin = uuid.uuid4().hex
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._pending: dict[str, dict] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._sent: dict[str, float] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pubsub = None
+        self._redis: Redis | None = None
+        self._writer = RedisWriter("progress-writer")
+
+    @property
+    def redis(self) -> Redis:
+        self._redis = self._redis or Redis()
+        return self._redis
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        threading.Thread(target=self._listen, name="progress-bus", daemon=True).start()
+
+    def stop(self):
+        self._loop = None
+        if self._pubsub:
+            self._pubsub.close()
+
+    def _listen(self):
+        while self._loop:
+            try:
+                self._pubsub = self.redis.subscribe_progress()
+                for message in self._pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    if payload["origin"] != self.origin and self._loop:
+                        self._loop.call_soon_threadsafe(self._deliver, payload["task_id"], payload["data"])
+            except Exception as e:
+                if self._loop:
+                    logging.warning("Progress bus lost redis, resubscribing: %s", e)
+                    time.sleep(1)
+
+    def publish(self, task_id: str, data: dict):
+        """Called in the event loop, use call_soon_threadsafe from download threads"""
+        wait = self._sent.get(task_id, 0) + self.interval - time.monotonic()
+        if data.get("status") in FINISHED or wait <= 0:
+            if timer := self._timers.pop(task_id, None):
+                timer.cancel()
+            self._pending.pop(task_id, None)
+            self._send(task_id, data)
+            return
+        # only the latest state is sent when the interval is over
+        self._pending[task_id] = data
+        if task_id not in self._timers:
+            self._timers[task_id] = asyncio.get_running_loop().call_later(wait, self._flush, task_id)
+
+    def _flush(self, task_id: str):
+        self._timers.pop(task_id, None)
+        if (data := self._pending.pop(task_id, None)) is not None:
+            self._send(task_id, data)
+
+    def _send(self, task_id: str, data: dict):
+        if data.get("status") in FINISHED:
+            self._sent.pop(task_id, None)
+        else:
+            self._sent[task_id] = time.monotonic()
+        self._deliver(task_id, data)
+        payload = json.dumps({"origin": self.origin, "task_id": task_id, "data": data}, ensure_ascii=False)
+        self._writer.submit(self.redis.publish_progress, task_id, payload, self.ttl)
+
+    def _deliver(self, task_id: str, data: dict):
+        for queue in self._subscribers.get(task_id, ()):
+            queue.put_nowait(data)
+
+    async def subscribe(self, task_id: str, heartbeat: float | None = None):
+        """
+        Last known state first, then every message until the task finishes.
+        Yields None after `heartbeat` seconds without a message.
+        """
+        queue = asyncio.Queue()
+        # registered before the replay is read, so nothing published in between is missed
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        try:
+            if last := await redis_call(self.redis.get_progress, task_id):
+                data = json.loads(last)["data"]
+                yield data
+                if data.get("status") in FINISHED:
+                    return
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield data
+                if data.get("status") in FINISHED:
+                    return
+        finally:
+            subscribers = self._subscribers.get(task_id, set())
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(task_id, None)
+
+    def snapshot(self) -> dict:
+        return {
+            "tasks": len(self._subscribers),
+            "subscribers": sum(len(v) for v in self._subscribers.values()),
+            "rate": round(1 / self.interval, 2) if self.interval else 0,
+        }
+
+
+class ProgressThrottle:
+    """
+    Progress callback for a download thread. Only the latest message is kept and handed to the loop
+    at most once per `interval`, a status change is handed over at once.
+    Loop wakeups per task stay bounded however often yt-dlp calls its hooks.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, callback, interval: float):
+        self._loop = loop
+        self._callback = callback
+        self.interval = interval
+        self._latest: dict | None = None
+        self._status = None
+        self._last = 0.0
+        self._scheduled = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __call__(self, data: dict):
+        with self._lock:
+            self._latest = data
+            changed, self._status = data.get("status") != self._status, data.get("status")
+            if changed:
+                self._loop.call_soon_threadsafe(self._flush)
+            elif not self._scheduled:
+                wait = max(0.0, self._last + self.interval - time.monotonic())
+                self._loop.call_soon_threadsafe(self._loop.call_later, wait, self._flush)
+            else:
+                return  # the pending flush picks this one up
+            self._scheduled = True
+
+    def _flush(self):
+        with self._lock:
+            data, self._latest = self._latest, None
+            self._scheduled = False
+            self._last = time.monotonic()
+        if data is not None and not self._closed:
+            self._callback(data)
+
+    def close(self):
+        """Drop whatever is pending, the final state is published by the caller"""
+        self._closed = True
+
+
+bus = ProgressBus(PROGRESS_RATE, WEB_TASK_TTL)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Admission control for web downloads: a bounded queue in front of a dedicated executor
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from config import WEB_DOWNLOAD_WORKERS, WEB_INFO_WORKERS, WEB_QUEUE_SIZE
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"download queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DownloadScheduler:
+    """
+    At most `workers` downloads run at once on their own threads, up to `max_queue` more wait in FIFO order.
+    Info lookups get a separate executor so a burst of downloads can't starve them.
+    """
+
+    def __init__(self, workers: int, info_workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="web-download")
+        self.info_executor = ThreadPoolExecutor(info_workers, thread_name_prefix="web-info")
+        self._slots: asyncio.Semaphore | None = None
+        # task id -> on_queue callback, in arrival order
+        self._waiting: dict[str, Callable | None] = {}
+        self._running = 0
+        # moving average of download durations, for Retry-After
+        self._duration = 60.0
+        self.stats = {"admitted": 0, "rejected": 0}
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        # created lazily so it belongs to the running loop
+        self._slots = self._slots or asyncio.Semaphore(self.workers)
+        return self._slots
+
+    def retry_after(self) -> int:
+        rounds = (len(self._waiting) + 1) / self.workers
+        return max(1, int(self._duration * rounds))
+
+    def admit(self, task_id: str):
+        """Take a place in the queue, or raise QueueFull when it would have to wait in a full one"""
+        if self._running + len(self._waiting) >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise QueueFull(self.retry_after())
+        self.stats["admitted"] += 1
+        # reserved right away, a burst of requests can't overshoot before their tasks start
+        self._waiting[task_id] = None
+
+    def cancel(self, task_id: str):
+        """Give back the place of an admitted task that won't reach `acquire`, a no-op once it got a slot"""
+        if self._waiting.pop(task_id, False) is not False:
+            self._moved()
+
+    def position(self, task_id: str) -> int:
+        """1-based place in the queue, 0 when not waiting"""
+        return list(self._waiting).index(task_id) + 1 if task_id in self._waiting else 0
+
+    async def acquire(self, task_id: str, on_queue: Callable | None = None) -> float:
+        """
+        Wait for a slot, the task must have been admitted. Returns the start time to hand to `release`.
+        on_queue(position) is called whenever the task's place in the queue changes, with 0 when it starts.
+        """
+        self._waiting[task_id] = on_queue
+        try:
+            if self.slots.locked() and on_queue:
+                # admitted tasks keep their place, later ones may already wait behind this one
+                on_queue(self.position(task_id))
+            await self.slots.acquire()
+        finally:
+            self._waiting.pop(task_id, None)
+            self._moved()
+        self._running += 1
+        if on_queue:
+            on_queue(0)
+        return time.time()
+
+    def release(self, started: float):
+        self._duration = self._duration * 0.8 + (time.time() - started) * 0.2
+        self._running -= 1
+        self.slots.release()
+
+    async def run(self, task_id: str, func: Callable, *args, on_queue: Callable | None = None):
+        """Run func in the download executor once the task got a slot"""
+        started = await self.acquire(task_id, on_queue)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.release(started)
+
+    def _moved(self):
+        # everyone still waiting moved up one place
+        for position, callback in enumerate(list(self._waiting.values()), 1):
+            if callback:
+                callback(position)
+
+    async def run_info(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.info_executor, func, *args)
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queued": len(self._waiting),
+            "max_queue": self.max_queue,
+            "avg_duration": round(self._duration, 1),
+            **self.stats,
+        }
+
+
+scheduler = DownloadScheduler(WEB_DOWNLOAD_WORKERS, WEB_INFO_WORKERS, WEB_QUEUE_SIZE)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Progressive pass-through: single-file formats are piped to the client while they download
+"""
+
+import logging
+import mimetypes
+import os
+import re
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from yt_dlp.networking import Request
+
+from engine.credentials import credentials
+from engine.generic import select_formats
+from engine.store import media_store, store_key
+
+from .downloader import WebDownloader
+
+# one file with both audio and video over plain http(s), nothing to merge
+PROGRESSIVE = "[acodec!=?none][vcodec!=?none][protocol~='^https?$']"
+READ_SIZE = 256 * 1024
+
+
+class ProgressiveStream:
+    """
+    Fetch a progressive format with the pooled YoutubeDL (cookies, proxy, headers) and tee it into
+    the task's directory, so the finished file is served by /api/file afterwards.
+    Formats that need merging are left to the normal download flow.
+    """
+
+    def __init__(self, url: str, height: int | None = None, format_id: str | None = None):
+        self.downloader = WebDownloader(url)
+        self.url = url
+        self.height = height
+        self.format_id = format_id
+        self.fmt: dict = {}
+        # kept for the normal download when there is no progressive format
+        self.info: dict | None = None
+        self.filepath = ""
+        self.key = ""
+        self.size = 0
+        self.position = 0
+        self._chunk = 0
+        self._stack = ExitStack()
+        self._ydl = None
+        self._response = None
+        self._file = None
+
+    @property
+    def filename(self) -> str:
+        return Path(self.filepath).name
+
+    @property
+    def media_type(self) -> str:
+        return mimetypes.guess_type(self.filepath)[0] or "application/octet-stream"
+
+    def _spec(self) -> str:
+        if self.format_id:
+            return f"{self.format_id}{PROGRESSIVE}"
+        return f"best[height<=?{self.height}]{PROGRESSIVE}" if self.height else f"best{PROGRESSIVE}"
+
+    def open(self) -> bool:
+        """Pick a progressive format and start fetching it, False when there is none"""
+        output = Path(self.downloader._tempdir, "%(title).70s.%(ext)s").as_posix()
+        try:
+            self._ydl = self._stack.enter_context(self.downloader._checkout(outtmpl=output))
+            info = self.info = self._ydl.extract_info(self.url, download=False)
+            selected = select_formats(self._ydl, info, self._spec())
+            if not selected or selected[0].get("requested_formats"):
+                self.close(abort=True)
+                return False
+            self.fmt = selected[0]
+            self.key = store_key(info.get("extractor_key") or "Generic", info["id"], self.fmt["format_id"])
+            # youtube throttles single big requests, yt-dlp asks for chunks of this size
+            self._chunk = (self.fmt.get("downloader_options") or {}).get("http_chunk_size") or 0
+            self.filepath = self._ydl.prepare_filename({**info, **self.fmt})
+            self._response = self._request(0)
+            self.size = self._total(self._response) or self.fmt.get("filesize") or 0
+            self._file = open(self.filepath + ".part", "wb")
+        except Exception as e:
+            credentials.report(self.downloader._credential, e)
+            self.close(abort=True)
+            raise
+        logging.info("Streaming format %s of %s, %s bytes", self.fmt.get("format_id"), self.url, self.size)
+        return True
+
+    def _request(self, start: int):
+        headers = dict(self.fmt.get("http_headers") or {})
+        if self._chunk:
+            headers["Range"] = f"bytes={start}-{start + self._chunk - 1}"
+        return self._ydl.urlopen(Request(self.fmt["url"], headers=headers))
+
+    @staticmethod
+    def _total(response) -> int:
+        if match := re.search(r"/(\d+)$", response.headers.get("Content-Range", "")):
+            return int(match.group(1))
+        return int(response.headers.get("Content-Length") or 0)
+
+    def read(self) -> bytes:
+        """Next piece of the file, written to disk before it's returned. b"" when finished."""
+        chunk = self._response.read(READ_SIZE)
+        if not chunk and self._chunk and self.position < self.size:
+            self._response.close()
+            self._response = self._request(self.position)
+            chunk = self._response.read(READ_SIZE)
+        if chunk:
+            self._file.write(chunk)
+            self.position += len(chunk)
+            return chunk
+        if self.size and self.position < self.size:
+            raise IOError(f"stream ended at {self.position} of {self.size} bytes")
+        self._file.close()
+        os.replace(self.filepath + ".part", self.filepath)
+        media_store.publish(self.key, [Path(self.filepath)])
+        return b""
+
+    def close(self, abort: bool = False):
+        if self._response:
+            self._response.close()
+        if self._file and not self._file.closed:
+            self._file.close()
+        if abort:
+            # a partial file isn't worth keeping
+            self.downloader.cleanup()
+        self._stack.close()
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that calls on_close when it's over, also when the client left before the body started"""
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
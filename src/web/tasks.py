@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Web download tasks, kept in redis so any uvicorn worker can report them
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from config import WEB_TASK_CACHE, WEB_TASK_TTL
+from database import Redis
+
+# a running task expires when it isn't updated for this long, e.g. its worker died
+ACTIVE_TTL = 6 * 3600
+FINISHED = ("completed", "error")
+# tasks of other workers are only seen in redis, long polls re-read them this often
+WAIT_POLL = 1.0
+
+
+class RedisWriter:
+    """
+    Redis writes made in the event loop run in one thread, in the order they were made:
+    the loop never waits for a round trip and the updates of a task can't overtake each other.
+    """
+
+    def __init__(self, name: str):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._log)
+        return future
+
+    @staticmethod
+    def _log(future: Future):
+        if not future.cancelled() and (e := future.exception()):
+            logging.error("Redis write failed: %s", e)
+
+
+async def redis_call(fn: Callable, *args):
+    # a blocking redis call awaited by async code, run in the loop's executor
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+class DownloadTask:
+    """Represents a download task with its state"""
+
+    __slots__ = (
+        "task_id", "url", "status", "progress", "speed", "eta",
+        "filename", "filepath", "error", "title", "filesize", "position", "version", "expires",
+    )
+    FIELDS = __slots__[:-1]
+    INTS = ("progress", "filesize", "position", "version")
+
+    def __init__(self, task_id: str, url: str):
+        self.task_id = task_id
+        self.url = url
+        self.status = "pending"  # pending, queued, downloading, completed, error
+        self.progress = 0
+        self.speed = ""
+        self.eta = ""
+        self.filename = ""
+        self.filepath = ""
+        self.error = ""
+        self.title = ""
+        self.filesize = 0
+        self.position = 0  # place in the download queue while queued
+        self.version = 0  # bumped by every update, clients compare it instead of the whole state
+        self.expires = time.time() + ACTIVE_TTL
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DownloadTask":
+        task = cls(data["task_id"], data["url"])
+        for name in cls.FIELDS:
+            if name in data:
+                setattr(task, name, int(float(data[name])) if name in cls.INTS else data[name])
+        return task
+
+
+class TaskStore:
+    """
+    Tasks written by this process are kept in a bounded LRU in front of redis hashes.
+    Tasks of other workers are read from redis. Finished tasks expire after `ttl` seconds.
+    Long polls wait for a task's version to change, woken by updates in this process.
+    Redis is written behind by a RedisWriter, reads run in the loop's executor.
+    """
+
+    def __init__(self, size: int, ttl: int):
+        self.size = size
+        self.ttl = ttl
+        self._tasks: OrderedDict[str, DownloadTask] = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis: Redis | None = None
+        self._waiters: dict[str, set[asyncio.Future]] = {}
+        self._writer = RedisWriter("task-writer")
+
+    @property
+    def redis(self) -> Redis:
+        self._redis = self._redis or Redis()
+        return self._redis
+
+    def _remember(self, task: DownloadTask):
+        with self._lock:
+            self._tasks[task.task_id] = task
+            self._tasks.move_to_end(task.task_id)
+            while len(self._tasks) > self.size:
+                self._tasks.popitem(last=False)
+
+    async def create(self, url: str) -> DownloadTask:
+        """New task, in redis before its id is handed out so every worker finds it"""
+        task = DownloadTask(uuid.uuid4().hex[:12], url)
+        self._remember(task)
+        written = self._writer.submit(self.redis.save_web_task, task.task_id, task.to_dict(), ACTIVE_TTL)
+        await asyncio.wrap_future(written)
+        return task
+
+    def update(self, task: DownloadTask, **fields):
+        """Set fields on the task and write only those to redis"""
+        for name, value in fields.items():
+            setattr(task, name, value)
+        task.version += 1
+        ttl = self.ttl if task.status in FINISHED else ACTIVE_TTL
+        task.expires = time.time() + ttl
+        # the whole hash gets the new expiry, finished tasks go away `ttl` after their last update
+        self._writer.submit(self.redis.save_web_task, task.task_id, {**fields, "version": task.version}, ttl)
+        self._remember(task)
+        self._wake(task.task_id)
+
+    def _wake(self, task_id: str):
+        with self._lock:
+            waiters = self._waiters.pop(task_id, ())
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def local(self, task_id: str) -> DownloadTask | None:
+        """The task if this process keeps it, without asking redis"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task and task.expires < time.time():
+                del self._tasks[task_id]
+                task = None
+        return task
+
+    async def get(self, task_id: str) -> DownloadTask | None:
+        if task := self.local(task_id):
+            return task
+        data = await redis_call(self.redis.get_web_task, task_id)
+        return DownloadTask.from_dict(data) if data else None
+
+    async def get_many(self, task_ids: list[str]) -> dict[str, DownloadTask | None]:
+        """Like get for several tasks, the ones not kept here are read from redis in one round trip"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for task_id in task_ids:
+                task = self._tasks.get(task_id)
+                if task and task.expires >= now:
+                    found[task_id] = task
+        missing = [task_id for task_id in task_ids if task_id not in found]
+        if missing:
+            for task_id, data in zip(missing, await redis_call(self.redis.get_web_tasks, missing)):
+                found[task_id] = DownloadTask.from_dict(data) if data else None
+        return {task_id: found[task_id] for task_id in task_ids}
+
+    async def wait(self, versions: dict[str, int], timeout: float) -> bool:
+        """
+        Wait until one of the tasks is past the given version, True when it happened before the timeout.
+        Returns False right away when all of them are finished, they won't change anymore.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            future = loop.create_future()
+            with self._lock:
+                # registered before reading, an update in between still wakes us
+                for task_id in versions:
+                    self._waiters.setdefault(task_id, set()).add(future)
+            try:
+                current = await self.get_many(list(versions))
+                if any(task is None or task.version != versions[task_id] for task_id, task in current.items()):
+                    return True
+                remaining = deadline - loop.time()
+                if remaining <= 0 or all(task.status in FINISHED for task in current.values()):
+                    return False
+                try:
+                    await asyncio.wait_for(future, min(remaining, WAIT_POLL))
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._lock:
+                    for task_id in versions:
+                        waiters = self._waiters.get(task_id)
+                        if waiters is not None:
+                            waiters.discard(future)
+                            if not waiters:
+                                del self._waiters[task_id]
+
+    def remove(self, task_id: str):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+        self._writer.submit(self.redis.delete_web_task, task_id)
+
+    async def save_batch(self, batch_id: str, task_ids: list[str], ttl: int):
+        await asyncio.wrap_future(self._writer.submit(self.redis.save_web_batch, batch_id, task_ids, ttl))
+
+    async def get_batch(self, batch_id: str) -> list[str]:
+        return await redis_call(self.redis.get_web_batch, batch_id)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"local": len(self._tasks), "size": self.size, "ttl": self.ttl, "waiting": len(self._waiters)}
+
+
+tasks = TaskStore(WEB_TASK_CACHE, WEB_TASK_TTL)
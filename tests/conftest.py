@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - conftest.py
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+# config and the database are read at import time
+os.environ.setdefault("OWNER", "1")
+os.environ.setdefault("DB_DSN", f"sqlite:///{tempfile.mkdtemp(prefix='ytdlbot-test-')}/bot.sqlite")
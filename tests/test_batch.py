@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_batch.py
+
+import io
+import zipfile
+
+from web import batch
+from web.batch import aggregate, zip_stream
+from web.tasks import DownloadTask
+
+
+def make_task(task_id: str, status: str, progress: int = 0) -> DownloadTask:
+    task = DownloadTask(task_id, f"https://example.com/{task_id}")
+    task.status, task.progress = status, progress
+    return task
+
+
+def test_zip_is_valid_and_keeps_duplicate_names(tmp_path, monkeypatch):
+    # small chunks, so entries are written in several pieces
+    monkeypatch.setattr(batch, "CHUNK_SIZE", 1000)
+    files = []
+    for i, size in enumerate([0, 2500, 10000]):
+        path = tmp_path / f"{i}.mp4"
+        path.write_bytes(bytes(range(256)) * (size // 256) + b"x" * (size % 256))
+        files.append((path.as_posix(), "video.mp4"))
+
+    chunks = list(zip_stream(files))
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+
+    assert archive.testzip() is None
+    assert archive.namelist() == ["video.mp4", "video (2).mp4", "video (3).mp4"]
+    for (path, _), name in zip(files, archive.namelist()):
+        info = archive.getinfo(name)
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert archive.read(name) == open(path, "rb").read()
+    # sent while it's written, not built in one piece
+    assert len([c for c in chunks if c]) > 3
+
+
+def test_aggregate():
+    members = [make_task("a", "completed", 100), make_task("b", "downloading", 50), make_task("c", "queued")]
+    state = aggregate(members)
+    assert (state["status"], state["progress"], state["completed"], state["failed"]) == ("downloading", 50, 1, 0)
+
+    members[1].status, members[2].status = "error", "completed"
+    state = aggregate(members)
+    assert (state["status"], state["progress"], state["completed"], state["failed"]) == ("completed", 100, 2, 1)
+    assert [item["status"] for item in state["items"]] == ["completed", "error", "completed"]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_files.py
+
+from urllib.parse import quote
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from web import files
+
+DATA = bytes(range(256)) * 40
+NAME = "vidéo \"1\".mp4"
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(DATA)
+    return path
+
+
+@pytest.fixture
+def client(media):
+    app = FastAPI()
+
+    @app.api_route("/file", methods=["GET", "HEAD"])
+    async def serve(request: Request):
+        return files.file_response(request, media.as_posix(), NAME)
+
+    return TestClient(app)
+
+
+def test_whole_file(client):
+    r = client.get("/file")
+    assert r.status_code == 200
+    assert r.content == DATA
+    assert r.headers["accept-ranges"] == "bytes"
+    assert r.headers["content-length"] == str(len(DATA))
+    assert r.headers["content-disposition"] == f"attachment; filename=\"vid?o 1.mp4\"; filename*=UTF-8''{quote(NAME)}"
+
+
+def test_head_has_no_body(client):
+    r = client.head("/file")
+    assert r.status_code == 200
+    assert r.content == b""
+    assert r.headers["content-length"] == str(len(DATA))
+
+
+@pytest.mark.parametrize(
+    "header, start, end",
+    [
+        ("bytes=100-199", 100, 200),
+        ("bytes=10000-", 10000, len(DATA)),
+        ("bytes=-50", len(DATA) - 50, len(DATA)),
+        # past the end is cut to the file size
+        ("bytes=9000-999999", 9000, len(DATA)),
+    ],
+)
+def test_range(client, header, start, end):
+    r = client.get("/file", headers={"Range": header})
+    assert r.status_code == 206
+    assert r.content == DATA[start:end]
+    assert r.headers["content-range"] == f"bytes {start}-{end - 1}/{len(DATA)}"
+
+
+@pytest.mark.parametrize("header", ["bytes=20000-", "bytes=300-200", "bytes=-0"])
+def test_unsatisfiable_range(client, header):
+    r = client.get("/file", headers={"Range": header})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+@pytest.mark.parametrize("header", ["bytes=1-2,5-6", "items=0-1", "bytes=abc"])
+def test_unsupported_range_sends_everything(client, header):
+    r = client.get("/file", headers={"Range": header})
+    assert r.status_code == 200
+    assert r.content == DATA
+
+
+def test_if_range(client):
+    etag = client.head("/file").headers["etag"]
+    r = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert r.status_code == 206
+    assert r.content == DATA[:10]
+    # the client's partial copy is of another version, it gets the whole file
+    r = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert r.status_code == 200
+    assert r.content == DATA
+
+
+def test_etag_match_is_not_modified(client, media):
+    etag = client.get("/file").headers["etag"]
+    r = client.get("/file", headers={"If-None-Match": f'"other", {etag}'})
+    assert r.status_code == 304
+    assert r.content == b""
+    media.write_bytes(DATA[:100])
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_accel_offload(client, media, monkeypatch):
+    monkeypatch.setattr(files, "FILE_OFFLOAD", "accel")
+    monkeypatch.setattr(files, "FILE_OFFLOAD_PREFIX", "/_files/")
+    relative = media.resolve().relative_to(files.Path(files.tempfile.gettempdir()).resolve())
+    r = client.get("/file", headers={"Range": "bytes=0-9"})
+    assert r.status_code == 200
+    assert r.content == b""
+    assert r.headers["x-accel-redirect"] == f"/_files/{quote(relative.as_posix())}"
+    assert r.headers["content-disposition"].startswith("attachment;")
+    assert "etag" in r.headers
+
+
+def test_sendfile_offload(client, media, monkeypatch):
+    monkeypatch.setattr(files, "FILE_OFFLOAD", "sendfile")
+    r = client.get("/file")
+    assert r.status_code == 200
+    assert r.headers["x-sendfile"] == quote(media.as_posix())
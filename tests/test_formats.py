@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_formats.py
+
+from engine.generic import order_formats
+from engine.planner import plan_choices, plan_formats
+
+MB = 1024 * 1024
+LIMIT = 2000 * MB
+
+
+def stat(ok: int, fail: int, time: float = 1.0) -> dict:
+    return {"ok": ok, "fail": fail, "time": time}
+
+
+def video(format_id: str, height: int, size: int = 0, vcodec: str = "avc1.640028", **extra) -> dict:
+    return {"format_id": format_id, "height": height, "vcodec": vcodec, "acodec": "none", "filesize": size, **extra}
+
+
+AUDIO = {"format_id": "140", "vcodec": "none", "acodec": "mp4a.40.2", "filesize": 50 * MB}
+INFO = {
+    "duration": 600,
+    "formats": [
+        AUDIO,
+        video("401", 2160, 3000 * MB, "av01.0.12M.08"),
+        video("400", 1440, 0, "av01.0.12M.08"),
+        video("137", 1080, 800 * MB),
+        video("248", 1080, 600 * MB, "vp9"),
+        video("136", 720, 400 * MB),
+        video("18", 360, 40 * MB, acodec="mp4a.40.2"),
+    ],
+}
+
+
+def test_order_formats_without_stats_keeps_the_order():
+    assert order_formats({}, ["best", "worst", "best", None]) == ["best", "worst", None]
+
+
+def test_order_formats_by_success_rate():
+    stats = {"a": stat(1, 9), "b": stat(9, 1), "default": stat(5, 0)}
+    # a fails more often than an untried selector is assumed to, default is None's key
+    assert order_formats(stats, ["a", "c", "b", None]) == [None, "b", "c", "a"]
+
+
+def test_order_formats_similar_rates_by_latency():
+    stats = {"slow": stat(20, 0, 9.0), "fast": stat(19, 0, 2.0)}
+    assert order_formats(stats, ["slow", "fast"]) == ["fast", "slow"]
+
+
+def test_plan_drops_only_formats_known_to_be_too_large():
+    ids = [p["format_id"] for p in plan_formats(INFO, limit=LIMIT)]
+    assert "401+140" not in ids
+    assert "400+140" in ids
+
+
+def test_plan_prefers_streamable_within_the_quality():
+    plans = plan_formats(INFO, "medium", limit=LIMIT)
+    assert [p["format_id"] for p in plans[:2]] == ["136+140", "18"]
+    assert plans[0]["filesize"] == int(450 * MB * 1.02)
+    # as a document the codec doesn't matter, the larger one wins
+    assert plan_formats(INFO, "high", "document", limit=LIMIT)[0]["format_id"] == "400+140"
+
+
+def test_plan_choices_one_per_height():
+    choices = plan_choices(INFO, limit=LIMIT)
+    assert [(c["height"], c["format_id"]) for c in choices] == [
+        (1440, "400+140"),
+        (1080, "137+140"),
+        (720, "136+140"),
+        (360, "18"),
+    ]
+    # unknown size is kept and reported as 0, the keyboard labels it unknown
+    assert choices[0]["filesize"] == 0
+    assert len(plan_choices(INFO, limit=LIMIT, count=2)) == 2
+
+
+def test_plan_choices_smaller_limit():
+    assert [c["height"] for c in plan_choices(INFO, limit=500 * MB)] == [1440, 720, 360]
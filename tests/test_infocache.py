@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_infocache.py
+
+import asyncio
+import time
+
+import pytest
+
+from web.infocache import InfoCache
+
+URL = "https://www.youtube.com/watch?v=jNQXAC9IVRw"
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get_info(self, key):
+        return self.data.get(key)
+
+    def set_info(self, key, value, ttl):
+        self.data[key] = value
+
+
+@pytest.fixture
+def cache():
+    cache = InfoCache(ttl=600, stale=3600)
+    cache._redis = FakeRedis()
+    return cache
+
+
+def counting_fetch(calls: list, delay: float = 0.05):
+    async def fetch():
+        calls.append(time.time())
+        await asyncio.sleep(delay)
+        return {"title": f"answer {len(calls)}"}
+
+    return fetch
+
+
+def test_concurrent_lookups_share_one_fetch(cache):
+    calls = []
+
+    async def main():
+        fetch = counting_fetch(calls)
+        # another link form of the same video joins the same lookup
+        urls = [URL] * 4 + ["https://youtu.be/jNQXAC9IVRw"]
+        return await asyncio.gather(*(cache.get(url, fetch) for url in urls))
+
+    answers = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(answer == {"title": "answer 1"} for answer in answers)
+    assert (cache.stats["miss"], cache.stats["coalesced"]) == (1, 4)
+    assert cache.snapshot()["inflight"] == 0
+
+
+def test_fresh_answer_is_a_hit(cache):
+    calls = []
+
+    async def main():
+        await cache.get(URL, counting_fetch(calls))
+        return await cache.get(URL, counting_fetch(calls))
+
+    assert asyncio.run(main()) == {"title": "answer 1"}
+    assert len(calls) == 1
+    assert cache.stats["hit"] == 1
+
+
+def test_stale_answer_is_served_while_refreshed(cache):
+    calls = []
+
+    async def main():
+        await cache.get(URL, counting_fetch(calls))
+        [key] = cache.redis.data
+        cache.redis.data[key]["ts"] -= cache.ttl + 1
+        fetch = counting_fetch(calls)
+        stale = await asyncio.gather(cache.get(URL, fetch), cache.get(URL, fetch))
+        # the refresh runs in the background, once for both lookups
+        await asyncio.sleep(0.2)
+        return stale, cache.redis.data[key]["info"]
+
+    stale, refreshed = asyncio.run(main())
+    assert stale == [{"title": "answer 1"}] * 2
+    assert refreshed == {"title": "answer 2"}
+    assert len(calls) == 2
+    assert cache.stats["stale"] == 2
+
+
+def test_failures_are_not_cached(cache):
+    attempts = []
+
+    async def fail():
+        attempts.append(1)
+        raise ValueError("unavailable")
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await cache.get(URL, fail)
+
+    asyncio.run(main())
+    assert len(attempts) == 2
+    assert cache.redis.data == {}
+    assert cache.stats["error"] == 2
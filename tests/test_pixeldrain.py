@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_pixeldrain.py
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from pyrogram import enums
+
+from engine import pixeldrain
+
+HUGE = 3000 * 1024 * 1024
+FILES = {f"f{i:02d}": {"id": f"f{i:02d}", "name": f"part{i}.bin", "size": 4} for i in range(12)}
+FILES["huge"] = {"id": "huge", "name": "huge.bin", "size": HUGE}
+LISTS = {
+    "album": [FILES[f"f{i:02d}"] for i in range(11)] + [FILES["huge"]],
+    "single": [FILES["f11"]],
+}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """The parts of the pixeldrain api the bot uses"""
+
+    requests: list[str] = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[0] == "list" and parts[1] in LISTS:
+            self._send(json.dumps({"id": parts[1], "files": LISTS[parts[1]]}).encode())
+        elif parts[0] == "file" and parts[1] in FILES:
+            self._send(json.dumps(FILES[parts[1]]).encode() if parts[-1] == "info" else b"data")
+        else:
+            self.send_error(404)
+
+    def _send(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    def send_chat_action(self, *args, **kwargs):
+        pass
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(("message", [text]))
+
+    def send_media_group(self, chat_id, media):
+        self.sent.append(("group", [Path(m.media).name for m in media]))
+        return [self._message(i) for i in range(len(media))]
+
+    def _send_one(self, kind):
+        def send(chat_id, path, caption=None, **kwargs):
+            self.sent.append((kind, [Path(path).name]))
+            return self._message(0)
+
+        return send
+
+    def __getattr__(self, name):
+        if name.startswith("send_"):
+            return self._send_one(name[5:])
+        raise AttributeError(name)
+
+    @staticmethod
+    def _message(i):
+        return SimpleNamespace(photo=None, video=None, document=SimpleNamespace(file_id=f"file-{i}"))
+
+
+@pytest.fixture
+def api(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(pixeldrain, "PIXELDRAIN_API", f"http://127.0.0.1:{server.server_port}")
+    StandIn.requests = []
+    yield StandIn.requests
+    server.shutdown()
+
+
+@pytest.fixture
+def message():
+    texts = []
+    msg = SimpleNamespace(chat=SimpleNamespace(id=1, type=enums.ChatType.PRIVATE), id=1, texts=texts)
+    msg.edit_text = texts.append
+    return msg
+
+
+def test_album_is_sent_in_groups_without_oversize_files(api, message):
+    client = FakeClient()
+    pixeldrain.pixeldrain_download(client, message, "https://pixeldrain.com/l/album")
+
+    assert message.texts[-1] == "✅ Success"
+    assert [kind for kind, _ in client.sent] == ["group", "document", "message"]
+    assert client.sent[0][1] == [f"{i:03d}-part{i}.bin" for i in range(10)]
+    # the eleventh file would make a group of one, which telegram rejects
+    assert client.sent[1][1] == ["010-part10.bin"]
+    assert not any(path.startswith("/file/huge?") for path in api)
+
+
+def test_skipped_files_are_listed(api, message):
+    client = FakeClient()
+    pixeldrain.pixeldrain_download(client, message, "https://pixeldrain.com/l/album")
+
+    [text] = client.sent[-1][1]
+    assert text.startswith("1 of 12 files are too large for Telegram")
+    assert "huge.bin (2.9GiB)" in text
+
+
+def test_single_file_list_is_not_a_media_group(api, message):
+    client = FakeClient()
+    pixeldrain.pixeldrain_download(client, message, "https://pixeldrain.com/l/single")
+
+    assert client.sent == [("document", ["000-part11.bin"])]
+
+
+def test_oversize_file_rejected_before_download(api, message):
+    pixeldrain.pixeldrain_download(FakeClient(), message, "https://pixeldrain.com/u/huge")
+
+    assert "too large for Telegram" in message.texts[-1]
+    assert api == ["/file/huge/info"]
+
+
+def test_unknown_list(api, message):
+    pixeldrain.pixeldrain_download(FakeClient(), message, "https://pixeldrain.com/l/missing")
+
+    assert message.texts[-1].startswith("Download failed!")
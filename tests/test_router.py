@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_router.py
+
+import re
+import sys
+
+import engine.router  # noqa: F401
+
+# engine re-exports a URLRouter instance under the module's name
+router = sys.modules["engine.router"]
+
+
+def extractor(name: str, pattern: str) -> type:
+    return type(
+        name,
+        (),
+        {
+            "_VALID_URL": pattern,
+            "ie_key": classmethod(lambda cls: name),
+            "suitable": classmethod(lambda cls, url: re.match(pattern, url) is not None),
+        },
+    )
+
+
+EXTRACTORS = [
+    extractor("Site", r"https?://(?:www\.)?site\.com/watch/(?P<id>\d+)"),
+    # no literal host: never indexed, only a full scan finds it
+    extractor("Embed", r"https?://[^/]+/embed/(?P<id>\w+)"),
+]
+
+
+def make_router(monkeypatch):
+    monkeypatch.setattr(router, "gen_extractor_classes", lambda: EXTRACTORS)
+    return router.URLRouter({"special.com": print})
+
+
+def test_indexed_host(monkeypatch):
+    r = make_router(monkeypatch)
+    assert r.extractor("https://www.site.com/watch/1") == "Site"
+    assert r.route("https://m.special.com/x") == router.Route(print, None)
+
+
+def test_wildcard_extractor_on_an_indexed_host(monkeypatch):
+    r = make_router(monkeypatch)
+    assert r.extractor("https://site.com/embed/abc") == "Embed"
+    assert r.extractor("https://other.org/embed/abc") == "Embed"
+    assert r.extractor("https://site.com/about") is None
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_scheduler.py
+
+import asyncio
+
+import pytest
+
+from web.scheduler import DownloadScheduler, QueueFull
+
+
+def test_queue_full():
+    scheduler = DownloadScheduler(workers=1, info_workers=1, max_queue=1)
+    scheduler.admit("a")
+    scheduler.admit("b")
+    with pytest.raises(QueueFull) as e:
+        scheduler.admit("c")
+    assert e.value.retry_after >= 1
+    assert scheduler.snapshot()["queued"] == 2
+    assert scheduler.stats == {"admitted": 2, "rejected": 1}
+
+
+def test_cancel_gives_the_place_back():
+    scheduler = DownloadScheduler(workers=1, info_workers=1, max_queue=0)
+    scheduler.admit("a")
+    with pytest.raises(QueueFull):
+        scheduler.admit("b")
+    scheduler.cancel("a")
+    scheduler.admit("b")
+    # unknown or already started tasks are left alone
+    scheduler.cancel("nope")
+    assert scheduler.position("b") == 1
+
+
+def test_queue_positions_and_release():
+    async def main():
+        scheduler = DownloadScheduler(workers=1, info_workers=1, max_queue=2)
+        moves = {"a": [], "b": [], "c": []}
+        for name in moves:
+            scheduler.admit(name)
+        started = await scheduler.acquire("a", moves["a"].append)
+        waiting = [asyncio.create_task(scheduler.acquire(name, moves[name].append)) for name in "bc"]
+        await asyncio.sleep(0)
+        assert (scheduler.position("b"), scheduler.position("c")) == (1, 2)
+
+        scheduler.release(started)
+        scheduler.release(await waiting[0])
+        scheduler.release(await waiting[1])
+        return moves, scheduler.snapshot()
+
+    moves, snapshot = asyncio.run(main())
+    assert moves["a"] == [0]
+    assert moves["b"][-1] == 0 and 1 in moves["b"]
+    assert moves["c"][-1] == 0 and 1 in moves["c"]
+    assert (snapshot["running"], snapshot["queued"]) == (0, 0)
+
+
+def test_cancelled_wait_releases_its_place():
+    async def main():
+        scheduler = DownloadScheduler(workers=1, info_workers=1, max_queue=1)
+        scheduler.admit("a")
+        scheduler.admit("b")
+        started = await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        # the client went away while queued
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.snapshot()["queued"] == 0
+        scheduler.admit("c")
+
+        scheduler.release(started)
+        # the slot of a went back, c starts without waiting
+        scheduler.release(await asyncio.wait_for(scheduler.acquire("c"), 1))
+        return scheduler.snapshot()
+
+    assert asyncio.run(main())["running"] == 0
+
+
+def test_run_releases_on_error():
+    def fail():
+        raise RuntimeError("boom")
+
+    async def main():
+        scheduler = DownloadScheduler(workers=1, info_workers=1, max_queue=0)
+        scheduler.admit("a")
+        with pytest.raises(RuntimeError):
+            await scheduler.run("a", fail)
+        scheduler.admit("b")
+        return await asyncio.wait_for(scheduler.run("b", lambda: "done"), 1)
+
+    assert asyncio.run(main()) == "done"
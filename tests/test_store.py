@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ytdlbot - test_store.py
+
+import shutil
+import threading
+
+import pytest
+
+from engine import store as store_module
+from engine.store import MediaStore
+
+
+@pytest.fixture
+def make_file(tmp_path):
+    def make(name: str, size: int):
+        path = tmp_path / "src" / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"x" * size)
+        return path
+
+    return make
+
+
+def test_disabled_store_keeps_nothing(tmp_path, make_file):
+    store = MediaStore((tmp_path / "store").as_posix(), 0)
+    store.publish("a", [make_file("a.mp4", 10)])
+    assert store.fetch("a", tmp_path.as_posix()) is None
+    assert not (tmp_path / "store").exists()
+    assert store.snapshot()["entries"] == 0
+
+
+def test_least_recently_used_is_evicted(tmp_path, make_file):
+    store = MediaStore((tmp_path / "store").as_posix(), 250)
+    store.publish("a", [make_file("a.mp4", 100)])
+    store.publish("b", [make_file("b.mp4", 100)])
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    assert [p.name for p in store.fetch("a", dest.as_posix())] == ["a.mp4"]
+
+    store.publish("c", [make_file("c.mp4", 100)])
+    assert store.fetch("b", dest.as_posix()) is None
+    snapshot = store.snapshot()
+    assert (snapshot["bytes"], snapshot["entries"]) == (200, 2)
+    assert (snapshot["evict"], snapshot["evicted_bytes"]) == (1, 100)
+
+
+def test_index_is_built_from_the_tree_once(tmp_path, make_file, monkeypatch):
+    root = (tmp_path / "store").as_posix()
+    MediaStore(root, 1000).publish("a", [make_file("a.mp4", 100)])
+
+    store = MediaStore(root, 1000)
+    assert store.snapshot()["bytes"] == 100
+    # later calls use the index, not the tree
+    monkeypatch.setattr(MediaStore, "_load", lambda self: self._index)
+    store.publish("b", [make_file("b.mp4", 50)])
+    assert (store.snapshot()["bytes"], store.snapshot()["entries"]) == (150, 2)
+
+
+def test_entry_removed_elsewhere_leaves_the_index(tmp_path, make_file):
+    root = (tmp_path / "store").as_posix()
+    store, other = MediaStore(root, 150), MediaStore(root, 1000)
+    store.publish("a", [make_file("a.mp4", 100)])
+    for name, s in (("dest-other", other), ("dest", store)):
+        (tmp_path / name).mkdir()
+        assert s.fetch("a", (tmp_path / name).as_posix())
+    # the other process evicts it first
+    other.budget = 0
+    other.evict()
+    store.publish("b", [make_file("b.mp4", 100)])
+    assert (store.snapshot()["bytes"], store.snapshot()["entries"]) == (100, 1)
+
+
+
+def test_entry_lost_during_fetch_leaves_nothing_behind(tmp_path, make_file, monkeypatch):
+    store = MediaStore((tmp_path / "store").as_posix(), 1000)
+    store.publish("a", [make_file("a.jpg", 10), make_file("a.mp4", 100)])
+    link = store_module._link
+
+    def link_then_lose_entry(src, dst):
+        link(src, dst)
+        # gone before the next file is linked
+        shutil.rmtree(src.parent, ignore_errors=True)
+
+    monkeypatch.setattr(store_module, "_link", link_then_lose_entry)
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    assert store.fetch("a", dest.as_posix()) is None
+    assert list(dest.iterdir()) == []
+    assert store.snapshot()["entries"] == 0
+
+
+def test_evict_during_fetch_waits_for_the_reader(tmp_path, make_file, monkeypatch):
+    root = (tmp_path / "store").as_posix()
+    store, other = MediaStore(root, 1000), MediaStore(root, 1)
+    store.publish("a", [make_file("a.mp4", 100)])
+    linking, evicted = threading.Event(), threading.Event()
+    link = store_module._link
+
+    def slow_link(src, dst):
+        linking.set()
+        # the other process tries to evict while the files are linked out
+        evicted.wait(5)
+        link(src, dst)
+
+    monkeypatch.setattr(store_module, "_link", slow_link)
+    evictor = threading.Thread(target=lambda: (linking.wait(5), other.evict(), evicted.set()))
+    evictor.start()
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    files = store.fetch("a", dest.as_posix())
+    evictor.join()
+
+    assert [f.name for f in files] == ["a.mp4"]
+    assert (dest / "a.mp4").read_bytes() == b"x" * 100
+    # skipped while locked, evicted once the fetch is done
+    assert other.stats["evict"] == 0
+    other.evict()
+    assert other.stats["evict"] == 1
+    assert store.fetch("a", dest.as_posix()) is None